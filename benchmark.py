@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# 离线性能基准：本地模拟 GitHub releases API 和下载 CDN，生成合成配置与 IPK，
+# 按插件数量分别计时 main.py 的各个阶段，结果写入 JSON 以便对比不同版本
+import io
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import random
+import shutil
+import tarfile
+import hashlib
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import main
+
+DEFAULT_PLATFORMS = ["aarch64_cortex-a53", "aarch64_generic", "x86_64"]
+
+# 文件名 -> 期望的架构，基准开始前先确认 PlatformClassifier 的分类结果
+CLASSIFIER_PLATFORMS = DEFAULT_PLATFORMS + ["arm_cortex-a7", "mipsel_24kc"]
+CLASSIFIER_CASES = {
+    "luci-app-foo_1.0-1_all.ipk": "all",
+    "luci-i18n-foo-zh_cn_1.0_all.ipk": "all",
+    "foo_1.0-1_aarch64_cortex-a53.ipk": "aarch64_cortex-a53",
+    "foo_1.2_aarch64_cortex-a53_23.05.ipk": "aarch64_cortex-a53",
+    "foo_1.0_arm_cortex-a7.ipk": "arm_cortex-a7",
+    "foo_1.0_arm_cortex-a7_neon-vfpv4.ipk": None,
+    "foo_1.0_mipsel_24kc_24kf.ipk": None,
+    "foo-x86_64_1.0_mipsel_24kc.ipk": "mipsel_24kc",
+    "foo_1.0_mips_24kc.ipk": None,
+    "foo_1.0_x86_64-openwrt.ipk": None,
+}
+
+def check_classifier():
+    classifier = main.PlatformClassifier(CLASSIFIER_PLATFORMS)
+    wrong = {name: classifier.classify(name) for name, arch in CLASSIFIER_CASES.items() if classifier.classify(name) != arch}
+    if wrong:
+        sys.exit(f"PlatformClassifier mismatches: {wrong}")
+    print(f"[OK] PlatformClassifier: {len(CLASSIFIER_CASES)} file names classified as expected")
+
+# gzip 头中的时间固定为 0，同一种子生成的 IPK 逐字节一致，录制的 GraphQL 响应中的大小在下次运行时仍然成立
+def _tar_gz(members):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w", format=tarfile.GNU_FORMAT) as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = 0
+            tar.addfile(info, io.BytesIO(data))
+    return gzip.compress(buf.getvalue(), mtime=0)
+
+# 与 ipkg-build 相同的外层 tar.gz：debian-binary、data.tar.gz、control.tar.gz
+def make_ipk(name, version, arch, size, rng):
+    control = (f"Package: {name}\nVersion: {version}\nArchitecture: {arch}\n"
+               f"Maintainer: bench\nDescription: synthetic package {name}\n").encode()
+    data = _tar_gz([(f"./usr/share/{name}/payload.bin", rng.randbytes(size))])
+    return _tar_gz([
+        ("./debian-binary", b"2.0\n"),
+        ("./data.tar.gz", data),
+        ("./control.tar.gz", _tar_gz([("./control", control)])),
+    ])
+
+# 每个插件一个仓库，最新的 release 含一个 _all 包和每个平台一个架构包
+def make_repos(plugins, platforms, ipk_size, seed=0):
+    rng = random.Random(seed)
+    repos = {}
+    for i in range(plugins):
+        name = f"bench{i}"
+        assets = {f"luci-app-{name}_1.0-1_all.ipk": make_ipk(f"luci-app-{name}", "1.0-1", "all", ipk_size // 4, rng)}
+        for arch in platforms:
+            assets[f"{name}_1.0-1_{arch}.ipk"] = make_ipk(name, "1.0-1", arch, ipk_size, rng)
+        repos[f"bench/{name}"] = [{
+            "id": i + 1,
+            "tag_name": "v1.0",
+            "prerelease": False,
+            "published_at": "2024-01-01T00:00:00Z",
+            "assets": assets,
+        }]
+    return repos
+
+def make_config(repos, platforms):
+    return {"plugins": [
+        {"name": repo.split("/", 1)[1], "repo": repo, "platforms": platforms, "release_type": "stable"}
+        for repo in repos
+    ]}
+
+_GRAPHQL_REPO = re.compile(r'(\w+): repository\(owner: "(.*?)", name: "(.*?)"\) \{\s*releases\(first: (\d+)')
+
+# ✅ 本地模拟服务：/repos/<owner>/<repo>/releases 支持分页、Link 和 ETag；POST /graphql 按别名返回
+# 与 REST 相同的 release 数据，并按查询内容记录响应，recorded 中已有的查询直接回放；/dl/ 下的资源支持 Range
+class FakeGitHub:
+    def __init__(self, repos, recorded=None):
+        self.repos = repos
+        self.recorded = recorded if recorded is not None else {}
+        self.replayed = 0
+        self.blobs = {}
+        self.requests = 0
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.base = f"http://127.0.0.1:{self.httpd.server_port}"
+        for repo, releases in repos.items():
+            for release in releases:
+                for asset_name, data in release["assets"].items():
+                    self.blobs[f"/dl/{repo}/{release['tag_name']}/{asset_name}"] = data
+
+    def _render(self, repo, release):
+        return dict(release, assets=[
+            {
+                "name": asset_name,
+                "size": len(data),
+                "browser_download_url": f"{self.base}/dl/{repo}/{release['tag_name']}/{asset_name}",
+                "digest": "sha256:" + hashlib.sha256(data).hexdigest(),
+            }
+            for asset_name, data in release["assets"].items()
+        ])
+
+    # 只实现 main.py 查询用到的字段：每个别名一个仓库，releases(first: N) 的第一页
+    def _graphql(self, query):
+        data = {}
+        for alias, owner, name, first in _GRAPHQL_REPO.findall(query):
+            releases = self.repos.get(f"{owner}/{name}")
+            if releases is None:
+                data[alias] = None
+                continue
+            nodes = []
+            for release in releases[:int(first)]:
+                rendered = self._render(f"{owner}/{name}", release)
+                nodes.append({
+                    "databaseId": rendered["id"],
+                    "tagName": rendered["tag_name"],
+                    "isPrerelease": rendered["prerelease"],
+                    "publishedAt": rendered["published_at"],
+                    "releaseAssets": {"nodes": [
+                        {"name": a["name"], "downloadUrl": a["browser_download_url"], "size": a["size"]}
+                        for a in rendered["assets"]
+                    ]},
+                })
+            data[alias] = {"releases": {"pageInfo": {"hasNextPage": len(releases) > int(first)}, "nodes": nodes}}
+        return {"data": data}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # 头和正文分两次写出，不关闭 Nagle 时每个请求会多出几十毫秒的延迟确认等待
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b"", headers=()):
+                self.send_response(status)
+                for key, value in headers:
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                fake.requests += 1
+                url = urlparse(self.path)
+                m = re.fullmatch(r"/repos/(.+/.+)/releases", url.path)
+                if m:
+                    releases = fake.repos.get(m[1])
+                    if releases is None:
+                        return self._send(404)
+                    query = parse_qs(url.query)
+                    per_page = int(query.get("per_page", ["30"])[0])
+                    page = int(query.get("page", ["1"])[0])
+                    chunk = releases[(page - 1) * per_page:page * per_page]
+                    body = json.dumps([fake._render(m[1], r) for r in chunk]).encode()
+                    etag = f'"{hashlib.sha1(url.path.encode() + body).hexdigest()}"'
+                    if self.headers.get("If-None-Match") == etag:
+                        return self._send(304, headers=[("ETag", etag)])
+                    headers = [("ETag", etag), ("Content-Type", "application/json")]
+                    if page * per_page < len(releases):
+                        headers.append(("Link", f'<{fake.base}{url.path}?per_page={per_page}&page={page + 1}>; rel="next"'))
+                    return self._send(200, body, headers)
+                data = fake.blobs.get(url.path)
+                if data is None:
+                    return self._send(404)
+                m = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+                if m and int(m[1]) < len(data):
+                    start = int(m[1])
+                    return self._send(206, data[start:], [("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")])
+                return self._send(200, data)
+
+            def do_POST(self):
+                fake.requests += 1
+                if urlparse(self.path).path != "/graphql":
+                    return self._send(404)
+                query = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))["query"]
+                key = hashlib.sha256(query.encode()).hexdigest()
+                # 记录时把本次的端口替换为占位符，回放时再换成当前地址
+                if key in fake.recorded:
+                    fake.replayed += 1
+                    body = fake.recorded[key].replace("{base}", fake.base).encode()
+                else:
+                    body = json.dumps(fake._graphql(query)).encode()
+                    fake.recorded[key] = body.decode().replace(fake.base, "{base}")
+                return self._send(200, body, [("Content-Type", "application/json")])
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# 记录被包装函数每次调用的耗时；sync_plugin 可能在多个线程中并发调用
+class StageTimer:
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def wrap(self, name, fn):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.samples.setdefault(name, []).append(time.perf_counter() - start)
+        return timed
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        yield
+        self.samples.setdefault(name, []).append(time.perf_counter() - start)
+
+    def summary(self):
+        result = {}
+        for name, samples in self.samples.items():
+            ordered = sorted(samples)
+            result[name] = {
+                "calls": len(samples),
+                "total": round(sum(samples), 6),
+                "mean": round(sum(samples) / len(samples), 6),
+                "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 6),
+                "max": round(ordered[-1], 6),
+            }
+        return result
+
+# 每个规模使用新的工作目录和新的缓存对象，互不影响
+def _reset_state(platforms):
+    main.RELEASE_CACHE = main.ReleaseCache(main.CACHE_DIR / "releases.json")
+    main.BLOB_STORE = main.BlobStore(main.BLOB_DIR, main.CACHE_DIR / "blob-manifest.json")
+    main.IPK_META = main.IpkMetaCache(main.CACHE_DIR / "ipk-meta.json")
+    main.STATE = main.StateManifest(main.CACHE_DIR / "state.json")
+    main.GITHUB = main.GitHubScheduler()
+    main.CLASSIFIER = main.PlatformClassifier(platforms)
+    main.METRICS = main.RunMetrics()
+
+# 计时的函数都通过模块全局名调用，替换后 rebuild_outputs 内部的各个阶段也会分别计时
+TIMED = ("sync_plugin", "copy_latest_to_opkg", "build_catalog", "build_platforms", "generate_html_index")
+
+def run_size(plugins, platforms, ipk_size, workers, backend="rest", keep_dir=None, recorded=None):
+    repos = make_repos(plugins, platforms, ipk_size)
+    config = make_config(repos, platforms)
+    workdir = Path(keep_dir or tempfile.mkdtemp(prefix=f"ipk-bench-{plugins}-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    timer = StageTimer()
+    originals = {name: getattr(main, name) for name in TIMED}
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        with open(main.CONFIG_FILE, "w", encoding="utf-8") as f:
+            json.dump(config, f)
+        _reset_state(platforms)
+        for name, fn in originals.items():
+            setattr(main, name, timer.wrap(name, fn))
+        with FakeGitHub(repos, recorded) as fake, contextlib.redirect_stdout(io.StringIO()):
+            main.GITHUB_API = fake.base
+            main.RELEASE_BACKEND = backend
+            main.RELEASE_CACHE.load()
+            main.BLOB_STORE.load()
+            main.STATE.load()
+            # 与 main.run 相同的流程：sync_all 之后 rebuild_outputs（按平台并行构建索引和分片，再生成 index.html）
+            with timer.stage("sync"):
+                main.sync_all(config["plugins"], workers)
+            with timer.stage("rebuild_outputs"):
+                catalog, _ = main.rebuild_outputs([p["name"] for p in config["plugins"]], {})
+            # 第二遍全部命中 ETag 缓存，衡量上游无变化时的开销
+            for name, fn in originals.items():
+                setattr(main, name, fn)
+            with timer.stage("noop_sync"):
+                main.sync_all(config["plugins"], workers)
+            requests = fake.requests
+            replayed = fake.replayed
+    finally:
+        for name, fn in originals.items():
+            setattr(main, name, fn)
+        os.chdir(cwd)
+        if not keep_dir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "plugins": plugins,
+        "platforms": len(platforms),
+        "assets": sum(len(r["assets"]) for releases in repos.values() for r in releases),
+        "packages": len(catalog.packages),
+        "http_requests": requests,
+        "graphql_replayed": replayed,
+        "stages": timer.summary(),
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark for main.py against a local fake GitHub")
+    parser.add_argument("--plugins", type=int, nargs="+", default=[10, 100, 1000], help="plugin counts to benchmark")
+    parser.add_argument("--platforms", type=int, default=len(DEFAULT_PLATFORMS), help="architectures per plugin")
+    parser.add_argument("--ipk-size", type=int, default=16 * 1024, help="payload bytes per architecture IPK")
+    parser.add_argument("--workers", type=int, default=1, help="plugins synced concurrently")
+    parser.add_argument("--backend", choices=["rest", "graphql"], default="rest", help="how release lists are fetched")
+    parser.add_argument("--output", default="benchmark-results.json", help="where to write the JSON results")
+    parser.add_argument("--graphql-fixture", metavar="FILE",
+                        help="replay GraphQL responses recorded in FILE and record new ones into it")
+    parser.add_argument("--keep", metavar="DIR", help="keep the generated tree for the last size under DIR")
+    return parser.parse_args(argv)
+
+def main_benchmark(argv=None):
+    args = parse_args(argv)
+    check_classifier()
+    platforms = (DEFAULT_PLATFORMS + [f"bench_arch{i}" for i in range(args.platforms)])[:args.platforms]
+    recorded = {}
+    if args.graphql_fixture and os.path.exists(args.graphql_fixture):
+        with open(args.graphql_fixture, "r", encoding="utf-8") as f:
+            recorded = json.load(f)
+    runs = []
+    for count in args.plugins:
+        keep = args.keep if args.keep and count == args.plugins[-1] else None
+        result = run_size(count, platforms, args.ipk_size, args.workers, args.backend, keep, recorded)
+        runs.append(result)
+        stages = ", ".join(f"{name} {s['total']:.3f}s" for name, s in result["stages"].items())
+        print(f"[OK] {count} plugins: {stages}")
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "ipk_size": args.ipk_size,
+        "workers": args.workers,
+        "backend": args.backend,
+        "runs": runs,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[OK] Results written to {args.output}")
+    if args.graphql_fixture:
+        with open(args.graphql_fixture, "w", encoding="utf-8") as f:
+            json.dump(recorded, f, indent=1, sort_keys=True)
+        print(f"[OK] {len(recorded)} GraphQL responses recorded in {args.graphql_fixture}")
+
+if __name__ == "__main__":
+    main_benchmark()
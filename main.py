@@ -1,50 +1,962 @@
 #!/usr/bin/env python3
 import datetime  
+import io
 import os
 import re
+import gzip
+import lzma
 import sys
 import json
+import time
+import random
 import shutil
+import tarfile
+import hashlib
+import argparse
+import posixpath
+import threading
 import requests
-import subprocess
+from requests.adapters import HTTPAdapter
 from pathlib import Path
+from contextlib import contextmanager
+from urllib.parse import urlparse, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from multiprocessing import get_context
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 # 配置
 CONFIG_FILE = "config.json"
 ARCHIVE_DIR = Path("archive")
 OPKG_DIR = Path("opkg")
 DOCS_DIR = Path(".")
+CACHE_DIR = Path(".cache")
+RELEASES_PER_PAGE = 30   # 每页 release 数量（GitHub 上限 100）
+MAX_RELEASE_PAGES = 10   # 最多向后翻的页数
+PARTIAL_DIR = CACHE_DIR / "partial"  # 未下载完成的文件，下次运行时断点续传
+BLOB_DIR = CACHE_DIR / "blobs"       # 按 SHA-256 存放的去重文件，archive/opkg 中的 IPK 均链接到这里
+DOWNLOAD_WORKERS = 4     # 同时进行的下载数
+DOWNLOAD_RATE_LIMIT = 0  # 下载总速率上限（字节/秒），0 为不限速
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_TIMEOUT = (10, 60)  # 下载的 (连接, 读取) 超时秒数
+API_TIMEOUT = (5, 20)        # API 请求的 (连接, 读取) 超时秒数
+INDEX_WORKERS = os.cpu_count() or 1  # 解析 IPK、按平台构建索引的进程数
+PARALLEL_BUILD_MIN = 500  # 软件包总数少于此值时在主进程内构建各平台，省去启动进程的开销
+INDEX_FORMATS = ["gz"]  # 除 Packages 外额外生成的压缩格式，可选 "gz"、"xz"
+SEARCH_DIR = "search"   # 网页搜索索引目录（与 index.html 同级），每个平台一个 JSON 分片
+SEARCH_PAGE_SIZE = 50   # 网页每次渲染的结果数量
+SYNC_WORKERS = 1      # 并发同步的插件数，1 为串行
+PER_HOST_LIMIT = 4    # 每个主机同时进行的请求上限
+POLL_MIN = 300          # 守护模式下单个仓库的最短轮询间隔（秒）
+POLL_MAX = 6 * 3600     # 最长轮询间隔
+POLL_DIVISOR = 24       # 轮询间隔 = 该仓库 release 间隔中位数 / POLL_DIVISOR
+CONFIG_CHECK_INTERVAL = 60  # 守护模式检查 config.json 是否修改的间隔
+GENERATION_FILE = CACHE_DIR / "generation"  # 每次构建完成后更新，serve 据此切换到新的构建
+SERVE_ROOTS = ("index.html", SEARCH_DIR, OPKG_DIR.name)  # serve 对外提供的顶层条目
+SERVE_CACHE_MAX = 4 * 1024 * 1024  # 小于此大小的索引文件（Packages*、搜索分片、index.html）常驻内存
+GITHUB_API = os.environ.get("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+RELEASE_BACKEND = "rest"  # "rest" 逐个仓库分页请求；"graphql" 每次请求批量查询多个仓库
+GRAPHQL_BATCH = 25        # GraphQL 后端每次请求查询的仓库数
+RATE_LIMIT_RESERVE = 10  # 剩余额度低于此值时推迟 priority <= 0 的插件
+NET_RETRIES = 3          # 连接失败、超时、403/429/5xx 的最大重试次数（仅幂等请求）
+NET_BACKOFF = 1.0        # 首次重试的最长等待秒数，之后每次翻倍，实际等待随机取 0~该值
+NET_MAX_WAIT = 60        # 单次等待上限；需要等更久时放弃（API 请求会推迟插件而不是阻塞）
+HEDGE_AFTER = 0          # API 请求超过此秒数未返回时再发一个相同请求，取先返回的结果；0 为关闭
+BREAKER_THRESHOLD = 5    # 同一主机连续失败次数达到此值后熔断
+BREAKER_COOLDOWN = 60    # 熔断持续秒数，期间直接跳过该主机，之后放行一个试探请求
 
-def log(msg): print(f"[INFO] {msg}")
-def log_ok(msg): print(f"[OK] {msg}")
-def log_clean(msg): print(f"[CLEAN] {msg}")
+# 并发同步时每个线程先把日志写入缓冲区，再按配置顺序统一输出
+_log_local = threading.local()
+
+def _emit(line):
+    buffer = getattr(_log_local, "buffer", None)
+    if buffer is None:
+        print(line)
+    else:
+        buffer.append(line)
+
+def log(msg): _emit(f"[INFO] {msg}")
+def log_ok(msg): _emit(f"[OK] {msg}")
+def log_clean(msg): _emit(f"[CLEAN] {msg}")
+def log_plan(msg): _emit(f"[PLAN] {msg}")
+
+def _buffered(fn, *args):
+    outer = getattr(_log_local, "buffer", None)
+    _log_local.buffer = []
+    try:
+        return fn(*args), _log_local.buffer
+    finally:
+        _log_local.buffer = outer
+
+# ✅ 运行指标：各阶段与各插件耗时、计数器；运行结束时写出 JSON 报告和 Prometheus textfile
+# 守护模式每次轮询新建一个实例，baseline 为创建时各缓存和调度器的累计计数，报告中只包含本次的增量
+class RunMetrics:
+    def __init__(self, baseline=None):
+        self.started_at = time.time()
+        self.phases = {}
+        self.plugins = {}
+        self.counters = {}
+        self.baseline = baseline or {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+    def plugin(self, name, seconds):
+        with self.lock:
+            self.plugins[name] = self.plugins.get(name, 0) + seconds
+
+    def add(self, key, n=1):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    # 各缓存和调度器自己维护的计数（进程内累计）
+    @staticmethod
+    def external_counters():
+        return {
+            "api_requests": GITHUB.requests,
+            "api_not_modified": GITHUB.not_modified,
+            "api_budget_used": GITHUB.consumed,
+            "graphql_budget_used": GITHUB.budget("graphql")["consumed"],
+            "plugins_deferred": len(GITHUB.deferred),
+            "release_cache_hits": RELEASE_CACHE.hits,
+            "release_cache_misses": RELEASE_CACHE.misses,
+            "ipk_meta_hits": IPK_META.hits,
+            "ipk_meta_misses": IPK_META.misses,
+            "ipk_files_hashed": IPK_META.hashed,
+            "bytes_saved_by_dedup": BLOB_STORE.bytes_saved,
+        }
+
+    def snapshot(self):
+        counters = dict(self.counters)
+        counters.update({k: v - self.baseline.get(k, 0) for k, v in self.external_counters().items()})
+        return {
+            "started_at": datetime.datetime.fromtimestamp(self.started_at, datetime.timezone.utc).isoformat(),
+            "phases": {k: round(v, 6) for k, v in self.phases.items()},
+            "plugins": {k: round(v, 6) for k, v in self.plugins.items()},
+            "counters": counters,
+            "rate_limit": {"limit": GITHUB.limit, "remaining": GITHUB.remaining, "reset": GITHUB.reset},
+        }
+
+    def prometheus(self, report):
+        def label(value):
+            return str(value).replace("\\", "\\\\").replace('"', '\\"')
+        lines = [
+            "# HELP ipk_center_last_run_timestamp_seconds Start time of the last run (or daemon poll).",
+            "# TYPE ipk_center_last_run_timestamp_seconds gauge",
+            f"ipk_center_last_run_timestamp_seconds {self.started_at:.0f}",
+            "# HELP ipk_center_phase_seconds Wall time per phase of the last run.",
+            "# TYPE ipk_center_phase_seconds gauge",
+        ]
+        lines += [f'ipk_center_phase_seconds{{phase="{label(k)}"}} {v}' for k, v in report["phases"].items()]
+        lines += [
+            "# HELP ipk_center_plugin_sync_seconds Wall time per plugin sync in the last run.",
+            "# TYPE ipk_center_plugin_sync_seconds gauge",
+        ]
+        lines += [f'ipk_center_plugin_sync_seconds{{plugin="{label(k)}"}} {v}' for k, v in report["plugins"].items()]
+        for key, value in sorted(report["counters"].items()):
+            lines += [f"# TYPE ipk_center_{key} gauge", f"ipk_center_{key} {value}"]
+        if report["rate_limit"]["remaining"] is not None:
+            lines += [
+                "# HELP ipk_center_rate_limit_remaining GitHub API requests left at the end of the last run.",
+                "# TYPE ipk_center_rate_limit_remaining gauge",
+                f"ipk_center_rate_limit_remaining {report['rate_limit']['remaining']}",
+            ]
+        return "\n".join(lines) + "\n"
+
+    # 先写临时文件再改名，node_exporter 的 textfile collector 不会读到半个文件
+    def write(self, directory: Path):
+        report = self.snapshot()
+        directory.mkdir(parents=True, exist_ok=True)
+        for name, text in (("run-report.json", json.dumps(report, indent=1, sort_keys=True)),
+                           ("ipk_center.prom", self.prometheus(report))):
+            tmp = directory / (name + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, directory / name)
+        return report
+
+METRICS = RunMetrics()
+
+# 所有请求共用一个 keep-alive 连接池
+def _make_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+SESSION = _make_session()
+
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+def _host_semaphore(url):
+    host = urlparse(url).netloc
+    with _host_slots_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = _host_slots[host] = threading.BoundedSemaphore(PER_HOST_LIMIT)
+    return slot
+
+@contextmanager
+def host_slot(url):
+    with _host_semaphore(url):
+        yield
+
+# 流式响应的正文在返回后才读取，名额保留到 r.close()（with r: 退出时）再释放
+def _release_on_close(r, slot):
+    close = r.close
+    released = threading.Event()
+    def close_and_release():
+        try:
+            close()
+        finally:
+            if not released.is_set():
+                released.set()
+                slot.release()
+    r.close = close_and_release
+
+class HostUnavailableError(requests.ConnectionError):
+    pass
+
+# ✅ 按主机熔断：连续失败后在冷却期内快速失败，不再反复重试已经不可用的上游
+class CircuitBreaker:
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = {}
+        self.open_until = {}
+        self.lock = threading.Lock()
+
+    def allow(self, host):
+        with self.lock:
+            until = self.open_until.get(host)
+            if until is None:
+                return True
+            # 冷却结束后只放行一个试探请求，失败则继续熔断
+            if time.monotonic() >= until:
+                self.open_until[host] = time.monotonic() + self.cooldown
+                return True
+            return False
+
+    def success(self, host):
+        with self.lock:
+            self.failures.pop(host, None)
+            self.open_until.pop(host, None)
+
+    def failure(self, host):
+        with self.lock:
+            self.failures[host] = self.failures.get(host, 0) + 1
+            if self.failures[host] >= self.threshold and host not in self.open_until:
+                self.open_until[host] = time.monotonic() + self.cooldown
+                log(f"{host} failed {self.failures[host]} times in a row, skipping it for {self.cooldown}s")
+
+BREAKER = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+
+def rate_limited(r):
+    return r.status_code == 429 or (r.status_code == 403 and (
+        r.headers.get("X-RateLimit-Remaining") == "0" or "Retry-After" in r.headers))
+
+def _backoff(attempt):
+    return random.uniform(0, min(NET_MAX_WAIT, NET_BACKOFF * 2 ** attempt))
+
+def _retry_wait(r, attempt):
+    retry_after = r.headers.get("Retry-After")
+    if retry_after and retry_after.isdigit():
+        return int(retry_after)
+    if rate_limited(r) and r.headers.get("X-RateLimit-Remaining") == "0":
+        return max(0, int(r.headers.get("X-RateLimit-Reset", 0)) - int(time.time()) + 1)
+    return _backoff(attempt)
+
+_hedge_pool = None
+_hedge_pool_lock = threading.Lock()
+
+def _slotted_request(method, url, **kwargs):
+    with host_slot(url):
+        return SESSION.request(method, url, **kwargs)
+
+# 第一个请求在 delay 秒内没有返回时再发一个相同请求，取先成功的结果，另一个返回后直接关闭
+# 两个请求各自占用一个主机名额
+def _hedged(delay, method, url, **kwargs):
+    global _hedge_pool
+    with _hedge_pool_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=8)
+    futures = [_hedge_pool.submit(_slotted_request, method, url, **kwargs)]
+    done, _ = wait(futures, timeout=delay)
+    if not done:
+        futures.append(_hedge_pool.submit(_slotted_request, method, url, **kwargs))
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        winner = next((f for f in done if not f.exception()), None)
+        if winner or not pending:
+            for f in futures:
+                if f is not winner:
+                    f.add_done_callback(lambda f: f.exception() or f.result().close())
+            return (winner or futures[0]).result()
+
+# ✅ 统一的网络请求入口：超时、带随机抖动的重试（仅幂等请求）、可选对冲请求和按主机熔断
+# observe 对每次收到的响应调用一次（包括被重试的响应），用于统计 API 额度
+def net_request(method, url, headers=None, timeout=DOWNLOAD_TIMEOUT, retries=NET_RETRIES,
+                hedge=0, idempotent=False, observe=None, **kwargs):
+    host = urlparse(url).netloc
+    if method not in ("GET", "HEAD") and not idempotent:
+        retries = 0
+    for attempt in range(retries + 1):
+        if not BREAKER.allow(host):
+            raise HostUnavailableError(f"{host} is unavailable, skipped by circuit breaker")
+        try:
+            if kwargs.get("stream"):
+                slot = _host_semaphore(url)
+                slot.acquire()
+                try:
+                    r = SESSION.request(method, url, headers=headers, timeout=timeout, **kwargs)
+                except BaseException:
+                    slot.release()
+                    raise
+                _release_on_close(r, slot)
+            elif hedge:
+                r = _hedged(hedge, method, url, headers=headers, timeout=timeout, **kwargs)
+            else:
+                r = _slotted_request(method, url, headers=headers, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            BREAKER.failure(host)
+            if attempt == retries:
+                raise
+            time.sleep(_backoff(attempt))
+            continue
+        if observe:
+            observe(r)
+        if r.status_code >= 500:
+            BREAKER.failure(host)
+        else:
+            BREAKER.success(host)
+        if not (r.status_code >= 500 or rate_limited(r)) or attempt == retries:
+            return r
+        delay = _retry_wait(r, attempt)
+        if delay > NET_MAX_WAIT:
+            return r
+        r.close()
+        time.sleep(delay)
+    return r
 
 def is_stable_version(tag_name: str) -> bool:
     unstable_keywords = ['beta', 'rc', 'alpha', 'test', 'dev']
     return not any(k in tag_name.lower() for k in unstable_keywords)
 
-def get_releases(repo):
-    url = f"https://api.github.com/repos/{repo}/releases"
-    headers = {'Accept': 'application/vnd.github.v3+json'}
-    r = requests.get(url, headers=headers)
-    return r.json() if r.status_code == 200 else []
+# 只保留 sync_plugin 用到的字段，缩小缓存体积
+def _slim_release(release):
+    return {
+        "id": release.get("id"),
+        "tag_name": release["tag_name"],
+        "prerelease": release.get("prerelease", False),
+        "published_at": release.get("published_at") or "",
+        "assets": [
+            {k: a.get(k) for k in ("name", "browser_download_url", "size", "digest")}
+            for a in release.get("assets", [])
+        ],
+    }
+
+# ✅ 按请求 URL 缓存 releases 响应（ETag / Last-Modified），未变化时只需一次 304 请求
+class ReleaseCache:
+    def __init__(self, path: Path, max_entries=1000, max_age=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.time() - entry["used_at"] > self.max_age:
+                del self.entries[key]
+                entry = None
+            return entry
+
+    def put(self, key, etag, last_modified, body):
+        with self.lock:
+            self.misses += 1
+            if not etag and not last_modified:
+                self.entries.pop(key, None)
+                return
+            self.entries[key] = {
+                "etag": etag,
+                "last_modified": last_modified,
+                "body": body,
+                "used_at": time.time(),
+            }
+
+    def hit(self, key):
+        with self.lock:
+            self.hits += 1
+            self.entries[key]["used_at"] = time.time()
+            return self.entries[key]["body"]
+
+    def save(self):
+        now = time.time()
+        with self.lock:
+            live = [(k, v) for k, v in self.entries.items() if now - v["used_at"] <= self.max_age]
+            live.sort(key=lambda kv: kv[1]["used_at"], reverse=True)
+            self.entries = dict(live[:self.max_entries])
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp, self.path)
+
+RELEASE_CACHE = ReleaseCache(CACHE_DIR / "releases.json")
+
+class RateLimitError(Exception):
+    pass
+
+# ✅ 跟踪 GitHub API 额度（X-RateLimit-*），重试由 net_request 负责，超出等待上限的限流转为 RateLimitError
+class GitHubScheduler:
+    def __init__(self, token=None):
+        self.token = token
+        # REST（core）与 GraphQL 各有独立额度，按响应的 X-RateLimit-Resource 分开记录
+        self.budgets = {}
+        self.requests = 0
+        self.not_modified = 0
+        self.deferred = []
+        self.lock = threading.Lock()
+
+    def budget(self, resource="core"):
+        return self.budgets.get(resource) or {"limit": None, "remaining": None, "reset": None, "consumed": 0}
+
+    # 调度和推迟插件以 REST 额度为准
+    @property
+    def limit(self):
+        return self.budget()["limit"]
+
+    @property
+    def remaining(self):
+        return self.budget()["remaining"]
+
+    @property
+    def reset(self):
+        return self.budget()["reset"]
+
+    @property
+    def consumed(self):
+        return self.budget()["consumed"]
+
+    def headers(self, extra=None):
+        headers = {'Accept': 'application/vnd.github.v3+json'}
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        headers.update(extra or {})
+        return headers
+
+    def observe(self, r):
+        with self.lock:
+            self.requests += 1
+            if r.status_code == 304:
+                self.not_modified += 1
+            try:
+                limit = int(r.headers["X-RateLimit-Limit"])
+                remaining = int(r.headers["X-RateLimit-Remaining"])
+                reset = int(r.headers["X-RateLimit-Reset"])
+            except (KeyError, ValueError):
+                return
+            budget = self.budgets.setdefault(r.headers.get("X-RateLimit-Resource", "core"), self.budget())
+            # 并发响应可能乱序到达，同一窗口内只取最小剩余额度
+            if reset == budget["reset"] and budget["remaining"] is not None:
+                remaining = min(remaining, budget["remaining"])
+                budget["consumed"] += budget["remaining"] - remaining
+            elif not (r.status_code == 304 and self.token):
+                budget["consumed"] += 1
+            budget.update(limit=limit, remaining=remaining, reset=reset)
+
+    def exhausted(self, resource="core"):
+        with self.lock:
+            budget = self.budget(resource)
+            return budget["remaining"] is not None and budget["remaining"] <= 0 and budget["reset"] > time.time()
+
+    # 额度耗尽时推迟所有插件；只剩预留额度时仅 priority > 0 的插件继续
+    def should_defer(self, priority):
+        with self.lock:
+            budget = self.budget()
+            if budget["remaining"] is None or budget["reset"] <= time.time():
+                return False
+            return budget["remaining"] <= 0 or (budget["remaining"] <= RATE_LIMIT_RESERVE and priority <= 0)
+
+    def defer(self, name):
+        with self.lock:
+            self.deferred.append(name)
+
+    # 优先级高的先同步；同优先级时距上次检查最久的先同步，额度不足时被推迟的是低优先级插件
+    def schedule(self, plugins, checked_at):
+        return sorted(plugins, key=lambda p: (-p.get("priority", 0), checked_at(p['name'])))
+
+    def request(self, method, url, headers=None, **kwargs):
+        r = net_request(method, url, headers=self.headers(headers), timeout=API_TIMEOUT,
+                        hedge=HEDGE_AFTER, observe=self.observe, **kwargs)
+        if rate_limited(r):
+            raise RateLimitError(f"HTTP {r.status_code} from {urlparse(url).netloc}")
+        return r
+
+    def get(self, url, headers=None):
+        return self.request("GET", url, headers)
+
+    def summary(self):
+        text = f"GitHub API: {self.requests} requests ({self.not_modified} not modified)"
+        for resource, budget in sorted(self.budgets.items()):
+            reset = datetime.datetime.fromtimestamp(budget["reset"], datetime.timezone.utc).strftime("%H:%M:%S")
+            text += (f", {resource}: {budget['consumed']} of {budget['limit']} budget used, "
+                     f"{budget['remaining']} remaining, resets at {reset} UTC")
+        if self.deferred:
+            text += f", {len(self.deferred)} plugins deferred"
+        return text
+
+GITHUB = GitHubScheduler(os.environ.get("GITHUB_TOKEN"))
+
+def fetch_release_page(url):
+    headers = {}
+    cached = RELEASE_CACHE.get(url)
+    if cached:
+        if cached.get("etag"):
+            headers['If-None-Match'] = cached["etag"]
+        if cached.get("last_modified"):
+            headers['If-Modified-Since'] = cached["last_modified"]
+    r = GITHUB.get(url, headers)
+    if r.status_code == 304 and cached:
+        page = RELEASE_CACHE.hit(url)
+        return page["releases"], page["next"]
+    # 重试后仍是 5xx 时报告为请求失败，而不是“没有 release”
+    if r.status_code >= 500:
+        r.raise_for_status()
+    if r.status_code != 200:
+        return [], None
+    page = {
+        "releases": [_slim_release(release) for release in r.json()],
+        "next": r.links.get("next", {}).get("url"),
+    }
+    RELEASE_CACHE.put(url, r.headers.get("ETag"), r.headers.get("Last-Modified"), page)
+    return page["releases"], page["next"]
+
+# ✅ 按需翻页（Link: rel=next），调用方找到合适版本后即可停止迭代
+def _releases_url(repo, per_page=None):
+    return f"{GITHUB_API}/repos/{repo}/releases?per_page={per_page or RELEASES_PER_PAGE}"
+
+def iter_release_pages(repo, per_page=None, page=1):
+    url = _releases_url(repo, per_page)
+    if page > 1:
+        url += f"&page={page}"
+    for _ in range(MAX_RELEASE_PAGES):
+        releases, url = fetch_release_page(url)
+        if releases:
+            yield releases
+        if not url:
+            break
+
+_GRAPHQL_RELEASES = """%s: repository(owner: %s, name: %s) {
+    releases(first: %d, orderBy: {field: CREATED_AT, direction: DESC}) {
+      pageInfo { hasNextPage }
+      nodes {
+        databaseId tagName isPrerelease publishedAt
+        releaseAssets(first: 100) { nodes { name downloadUrl size } }
+      }
+    }
+  }"""
+
+def _release_from_graphql(node):
+    return _slim_release({
+        "id": node.get("databaseId"),
+        "tag_name": node["tagName"],
+        "prerelease": node.get("isPrerelease", False),
+        "published_at": node.get("publishedAt"),
+        "assets": [
+            {"name": a["name"], "browser_download_url": a["downloadUrl"], "size": a.get("size")}
+            for a in node["releaseAssets"]["nodes"]
+        ],
+    })
+
+# ✅ GraphQL 后端：每个仓库一个别名，一次请求取回一批仓库的第一页 releases
+# 返回 {仓库: (releases, 是否还有下一页)}；请求失败的仓库不在结果中，由 REST 后端补上
+def fetch_releases_graphql(repos):
+    results = {}
+    items = list(repos.items())
+    for start in range(0, len(items), GRAPHQL_BATCH):
+        batch = items[start:start + GRAPHQL_BATCH]
+        fields = []
+        for i, (repo, first) in enumerate(batch):
+            owner, name = repo.split("/", 1)
+            fields.append(_GRAPHQL_RELEASES % (f"r{i}", json.dumps(owner), json.dumps(name), min(first, 100)))
+        query = "query {\n  " + "\n  ".join(fields) + "\n}"
+        if GITHUB.exhausted("graphql"):
+            log("GraphQL rate limit exhausted, falling back to REST.")
+            break
+        try:
+            r = GITHUB.request("POST", f"{GITHUB_API}/graphql", json={"query": query}, idempotent=True)
+        except (RateLimitError, requests.RequestException) as e:
+            log(f"GraphQL release query failed ({e}), falling back to REST.")
+            continue
+        if r.status_code != 200:
+            log(f"GraphQL release query failed (HTTP {r.status_code}), falling back to REST.")
+            continue
+        data = r.json().get("data") or {}
+        for i, (repo, _) in enumerate(batch):
+            if f"r{i}" not in data:
+                continue
+            node = data[f"r{i}"]
+            # 仓库不存在时别名为 null，与 REST 的 404 一样视为没有 release
+            if node is None:
+                results[repo] = ([], False)
+            else:
+                releases = node["releases"]
+                results[repo] = ([_release_from_graphql(n) for n in releases["nodes"]], releases["pageInfo"]["hasNextPage"])
+    return results
+
+PREFETCHED_RELEASES = {}
+
+def prefetch_releases(plugins):
+    repos = {}
+    for plugin in plugins:
+        per_page = plugin.get("per_page") or RELEASES_PER_PAGE
+        repos[plugin['repo']] = max(repos.get(plugin['repo'], 0), per_page)
+    PREFETCHED_RELEASES.clear()
+    PREFETCHED_RELEASES.update(fetch_releases_graphql(repos))
+
+# 优先使用 GraphQL 预取的第一页；需要继续翻页时从 REST 的第 2 页接着读
+def release_pages(plugin):
+    repo = plugin['repo']
+    if repo not in PREFETCHED_RELEASES:
+        yield from iter_release_pages(repo, plugin.get("per_page"))
+        return
+    releases, has_next = PREFETCHED_RELEASES[repo]
+    if releases:
+        yield releases
+    if has_next:
+        yield from iter_release_pages(repo, plugin.get("per_page"), page=2)
+
+def release_matches(release, release_type):
+    if release_type == "stable":
+        return not release.get("prerelease", False) and is_stable_version(release['tag_name'])
+    if release_type == "pre_release":
+        return release.get("prerelease", False)
+    return True
 
-def download_asset(url, save_path):
+# GitHub 按创建时间倒序分页返回，取第一个含 IPK 候选版本的页面中发布时间最新的版本
+def select_release(pages, release_type):
+    scanned = 0
+    for releases in pages:
+        scanned += len(releases)
+        candidates = [
+            r for r in releases
+            if release_matches(r, release_type) and any(a['name'].endswith(".ipk") for a in r['assets'])
+        ]
+        if candidates:
+            return max(candidates, key=lambda r: r['published_at']), scanned
+    return None, scanned
+
+class RateLimiter:
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    # 为每个数据块预约发送时间片，所有下载线程共享总速率
+    def consume(self, nbytes):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + nbytes / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+DOWNLOAD_LIMITER = RateLimiter()
+_download_pool = None
+_download_pool_lock = threading.Lock()
+
+def _partial_path(url):
+    return PARTIAL_DIR / (hashlib.sha1(url.encode()).hexdigest() + ".part")
+
+_url_locks = {}
+_url_locks_lock = threading.Lock()
+
+# 多个插件条目指向同一仓库时会并发下载同一个 URL，按 URL 串行，避免共用同一个 .part 文件
+def _url_lock(url):
+    with _url_locks_lock:
+        lock = _url_locks.get(url)
+        if lock is None:
+            lock = _url_locks[url] = threading.Lock()
+    return lock
+
+# 续传时用 If-Range 带上首次响应的强 ETag（没有时用 Last-Modified），上游文件变化后服务器返回完整内容
+def _save_validator(path: Path, r):
+    etag = r.headers.get("ETag")
+    validator = etag if etag and not etag.startswith("W/") else r.headers.get("Last-Modified")
+    if validator:
+        path.write_text(validator, encoding="utf-8")
+    elif path.exists():
+        path.unlink()
+
+FICLONE = 0x40049409  # Linux ioctl，btrfs/xfs 上的写时复制克隆
+
+def _reflink(src: Path, dst: Path):
+    import fcntl
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+# 依次尝试硬链接、reflink、普通复制，返回是否避免了数据复制
+def link_or_copy(src, dst):
     try:
-        r = requests.get(url, stream=True)
-        if r.status_code == 200:
-            save_path.parent.mkdir(parents=True, exist_ok=True)
-            with open(save_path, "wb") as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            log_ok(f"Downloaded: {save_path}")
-            return True
+        os.link(src, dst)
+        METRICS.add("files_linked")
+        return True
+    except OSError:
+        pass
+    try:
+        _reflink(src, dst)
+        shutil.copystat(src, dst)
+        METRICS.add("files_linked")
+        return True
+    except (OSError, ImportError):
+        if os.path.exists(dst):
+            os.unlink(dst)
+    shutil.copy2(src, dst)
+    METRICS.add("bytes_copied", os.path.getsize(dst))
+    return False
+
+# ✅ 内容寻址存储：每个唯一文件只下载、保存一次
+# manifest 记录 inode -> SHA256（附大小和 mtime 校验），生成索引时无需重新读取文件内容
+class BlobStore:
+    def __init__(self, root: Path, manifest_path: Path):
+        self.root = root
+        self.manifest_path = manifest_path
+        self.by_url = {}
+        self.digests = {}
+        self.bytes_saved = 0
+        self.lock = threading.Lock()
+
+    # 每条记录带有登记时的路径，加载时逐个 stat 校验（不读取内容）：文件已删除或被替换的记录丢弃；
+    # 从 actions/cache 恢复后 inode 全部变化、mtime 可能只保留到秒，大小和秒级 mtime 一致的按新 inode 重新登记。
+    # blob 的文件名就是它的 SHA256，最后再按文件名重新登记全部 blob
+    def load(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                recorded = json.load(f)
+        except (OSError, ValueError):
+            recorded = {}
+        self.digests = {}
+        for key, entry in recorded.items():
+            if len(entry) != 4:
+                continue
+            digest, size, mtime_ns, path = entry
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if f"{st.st_dev}:{st.st_ino}" == key and st.st_mtime_ns == mtime_ns:
+                self.digests[key] = entry
+            elif st.st_size == size and st.st_mtime_ns // 10**9 == mtime_ns // 10**9:
+                self.remember(path, digest)
+        if self.root.exists():
+            for blob in self.root.glob("*/*"):
+                self.remember(blob, blob.name)
+
+    def save(self):
+        with self.lock:
+            self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.manifest_path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.digests, f)
+            os.replace(tmp, self.manifest_path)
+
+    def remember(self, path, digest):
+        st = os.stat(path)
+        with self.lock:
+            self.digests[f"{st.st_dev}:{st.st_ino}"] = [digest, st.st_size, st.st_mtime_ns, str(path)]
+
+    # 硬链接与 blob 共享 inode；复制出来的文件在 link 时单独登记
+    def digest_of(self, path):
+        st = os.stat(path)
+        entry = self.digests.get(f"{st.st_dev}:{st.st_ino}")
+        if entry and entry[1:3] == [st.st_size, st.st_mtime_ns]:
+            return entry[0]
+        return None
+
+    def path_for(self, digest):
+        return self.root / digest[:2] / digest
+
+    def has(self, digest):
+        return self.path_for(digest).exists()
+
+    def add(self, src: Path, digest):
+        blob = self.path_for(digest)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        if blob.exists():
+            src.unlink()
         else:
-            log(f"Download failed: {url}, status {r.status_code}")
-            return False
-    except Exception as e:
-        log(f"Exception during download: {e}")
-        return False
+            os.replace(src, blob)
+        self.remember(blob, digest)
+        return blob
+
+    def saved(self, nbytes):
+        with self.lock:
+            self.bytes_saved += nbytes
+
+    def link(self, digest, dest: Path):
+        blob = self.path_for(digest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(dest.name + ".tmp")
+        if tmp.exists():
+            tmp.unlink()
+        link_or_copy(blob, tmp)
+        os.replace(tmp, dest)
+        self.remember(dest, digest)
+
+    # 删除不再被 archive/opkg 引用（硬链接数为 1）的文件
+    def prune(self):
+        removed = 0
+        if not self.root.exists():
+            return removed
+        for blob in self.root.glob("*/*"):
+            if blob.stat().st_nlink == 1:
+                blob.unlink()
+                removed += 1
+        return removed
+
+    def stats(self):
+        blobs = list(self.root.glob("*/*")) if self.root.exists() else []
+        return len(blobs), sum(b.stat().st_size for b in blobs)
+
+BLOB_STORE = BlobStore(BLOB_DIR, CACHE_DIR / "blob-manifest.json")
+
+# ✅ 先写入 .cache/partial 下的临时文件，边下载边计算 SHA-256，校验大小后移入 BlobStore；中断后用 Range 续传
+def download_blob(url, size=None, expected=None):
+    part_path = _partial_path(url)
+    validator_path = part_path.with_suffix(".validator")
+    part_path.parent.mkdir(parents=True, exist_ok=True)
+    for attempt in range(NET_RETRIES + 1):
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        validator = validator_path.read_text(encoding="utf-8") if validator_path.exists() else None
+        # 既没有摘要也没有验证器时无法确认 .part 与当前文件是同一份内容（同名同大小重新上传），从头下载
+        if (size is not None and offset > size) or (offset and not (expected or validator)):
+            part_path.unlink()
+            offset = 0
+        headers = {}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            if validator:
+                headers["If-Range"] = validator
+        sha256 = hashlib.sha256()
+        try:
+            r = net_request("GET", url, headers=headers, stream=True)
+        except requests.RequestException as e:
+            log(f"Exception during download: {e}")
+            return None
+        try:
+            with r:
+                if r.status_code == 206 and r.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+                    mode = "ab"
+                elif r.status_code == 200:
+                    mode = "wb"
+                    _save_validator(validator_path, r)
+                elif r.status_code == 416 and offset == size:
+                    mode = None
+                else:
+                    log(f"Download failed: {url}, status {r.status_code}")
+                    return None
+                if mode == "ab" or mode is None:
+                    with open(part_path, "rb") as f:
+                        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+                            sha256.update(chunk)
+                if mode:
+                    with open(part_path, mode) as f:
+                        for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            DOWNLOAD_LIMITER.consume(len(chunk))
+                            METRICS.add("bytes_downloaded", len(chunk))
+                            sha256.update(chunk)
+                            f.write(chunk)
+        except (requests.RequestException, OSError) as e:
+            # 传输中断时已收到的数据保留在 .part 中，下一轮从断点续传
+            if isinstance(e, requests.RequestException) and attempt < NET_RETRIES:
+                BREAKER.failure(urlparse(url).netloc)
+                log(f"Download interrupted, resuming: {url} ({e})")
+                time.sleep(_backoff(attempt))
+                continue
+            log(f"Exception during download: {e}")
+            return None
+        break
+
+    if validator_path.exists():
+        validator_path.unlink()
+    received = part_path.stat().st_size
+    if size is not None and received != size:
+        log(f"Size mismatch for {url}: expected {size}, got {received}")
+        if received > size:
+            part_path.unlink()
+        return None
+    digest = sha256.hexdigest()
+    # GitHub 提供了摘要时必须一致，不一致的文件丢弃，下次运行重新下载
+    if expected and digest != expected:
+        log(f"Checksum mismatch for {url}: expected {expected}, got {digest}")
+        part_path.unlink()
+        return None
+    BLOB_STORE.add(part_path, digest)
+    METRICS.add("files_downloaded")
+    return digest
+
+# 同一个资源（如 _all.ipk）只下载一次，再链接到每个平台的 archive 目录
+def download_asset(asset, targets):
+    url = asset['browser_download_url']
+    size = asset.get('size')
+    expected = (asset.get('digest') or "").removeprefix("sha256:") or None
+    with _url_lock(url):
+        known = expected or BLOB_STORE.by_url.get(url)
+        if known and BLOB_STORE.has(known):
+            digest = known
+            downloaded = False
+            BLOB_STORE.saved(BLOB_STORE.path_for(digest).stat().st_size)
+        else:
+            digest = download_blob(url, size, expected)
+            if not digest:
+                return 0
+            downloaded = True
+        BLOB_STORE.by_url[url] = digest
+
+    # 除第一个目标外其余平台都只是链接，不再重复下载
+    BLOB_STORE.saved(BLOB_STORE.path_for(digest).stat().st_size * (len(targets) - 1))
+    for i, save_path in enumerate(targets):
+        BLOB_STORE.link(digest, save_path)
+        log_ok(f"Downloaded: {save_path}" if downloaded and i == 0 else f"Linked: {save_path}")
+    return len(targets)
+
+def download_assets(jobs):
+    global _download_pool
+    if DOWNLOAD_WORKERS <= 1 or len(jobs) <= 1:
+        return sum(download_asset(*job) for job in jobs)
+    with _download_pool_lock:
+        if _download_pool is None:
+            _download_pool = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS)
+    futures = [_download_pool.submit(_buffered, download_asset, *job) for job in jobs]
+    new_count = 0
+    for future in futures:
+        ok, lines = future.result()
+        for line in lines:
+            _emit(line)
+        new_count += ok
+    return new_count
 
 def clean_old_versions(base_path: Path, keep=10):
     if not base_path.exists(): return
@@ -54,114 +966,485 @@ def clean_old_versions(base_path: Path, keep=10):
         log_clean(f"Removing old version: {old_dir}")
         shutil.rmtree(old_dir)
 
-# ✅ 修改：只复制最新版本，不再生成每个插件的 Packages.gz
+def _link_into_opkg(src, dst):
+    METRICS.add("opkg_files_added")
+    if link_or_copy(src, dst):
+        BLOB_STORE.saved(os.path.getsize(dst))
+
+# inode 不同（复制或 reflink）时先比较 blob manifest 中登记的摘要，都查不到时才读取文件计算
+def _same_file(a: Path, b: Path):
+    sa, sb = a.stat(), b.stat()
+    if (sa.st_dev, sa.st_ino) == (sb.st_dev, sb.st_ino):
+        return True
+    if sa.st_size != sb.st_size:
+        return False
+    da, db = BLOB_STORE.digest_of(a), BLOB_STORE.digest_of(b)
+    if da and db:
+        return da == db
+    return (da or _file_sha256(a).hex()) == (db or _file_sha256(b).hex())
+
+# 按大小和哈希比较两个目录，只链接/复制新增或变化的文件、删除多余文件；未变化的文件保留原 inode 和 mtime
+def sync_tree(src: Path, dst: Path):
+    added = removed = kept = 0
+    wanted = set()
+    for entry in sorted(src.iterdir()):
+        target = dst / entry.name
+        wanted.add(entry.name)
+        if entry.is_dir():
+            target.mkdir(exist_ok=True)
+            counts = sync_tree(entry, target)
+            added, removed, kept = added + counts[0], removed + counts[1], kept + counts[2]
+        elif target.is_file() and _same_file(entry, target):
+            kept += 1
+        else:
+            tmp = dst / f".{entry.name}.tmp"
+            if tmp.exists():
+                tmp.unlink()
+            _link_into_opkg(entry, tmp)
+            os.replace(tmp, target)
+            SUPERSEDED.discard(target)
+            # 登记最终路径，manifest 加载时按路径校验
+            digest = BLOB_STORE.digest_of(entry)
+            if digest:
+                BLOB_STORE.remember(target, digest)
+            added += 1
+    for stale in dst.iterdir():
+        if stale.name not in wanted and stale not in SUPERSEDED:
+            SUPERSEDED.add(stale)
+            removed += 1
+    return added, removed, kept
+
+# ✅ 被取代的 opkg 版本目录和文件：旧的 Packages 索引仍引用它们，serve 切换到新构建前不能删除。
+# 构建期间留在原处但不计入软件包目录，mark_generation() 之后由 remove_superseded() 删除
+SUPERSEDED = set()
+
+def _superseded(ipk_file):
+    return ipk_file in SUPERSEDED or ipk_file.parent in SUPERSEDED
+
+def remove_superseded():
+    for old in sorted(SUPERSEDED):
+        log_clean(f"Removing old version: {old}")
+        shutil.rmtree(old, ignore_errors=True) if old.is_dir() else old.unlink(missing_ok=True)
+    SUPERSEDED.clear()
+
+# ✅ 修改：只同步最新版本；新版本先在暂存目录中准备好再整体改名，旧版本留到新索引发布后才删除
 def copy_latest_to_opkg(platform_path: Path, opkg_path: Path, keep=1):
     versions = [d for d in platform_path.iterdir() if d.is_dir()]
     versions.sort(key=lambda d: d.stat().st_mtime, reverse=True)
     latest = versions[:keep]
 
-    if opkg_path.exists():
-        shutil.rmtree(opkg_path)
-
+    opkg_path.mkdir(parents=True, exist_ok=True)
     for version in latest:
         target_ver = opkg_path / version.name
-        shutil.copytree(version, target_ver)
+        SUPERSEDED.discard(target_ver)
+        if target_ver.is_dir():
+            added, removed, kept = sync_tree(version, target_ver)
+            METRICS.add("opkg_files_removed", removed)
+            METRICS.add("opkg_files_kept", kept)
+            if added or removed:
+                log_ok(f"Updated {target_ver}: {added} files added, {removed} removed")
+        else:
+            staging = opkg_path / f".staging-{version.name}"
+            if staging.exists():
+                shutil.rmtree(staging)
+            shutil.copytree(version, staging, copy_function=_link_into_opkg)
+            os.rename(staging, target_ver)
+            # 改名后再按最终路径登记摘要
+            for src in version.rglob("*"):
+                digest = BLOB_STORE.digest_of(src) if src.is_file() else None
+                if digest:
+                    BLOB_STORE.remember(target_ver / src.relative_to(version), digest)
 
-def generate_packages_index(opkg_plugin_path: Path):
-    pkg_files = list(opkg_plugin_path.glob("*.ipk"))
-    if not pkg_files:
-        log(f"No IPK files at {opkg_plugin_path}")
-        return
+    wanted = {version.name for version in latest}
+    SUPERSEDED.update(old for old in opkg_path.iterdir() if old.name not in wanted)
+
+class _HashingReader:
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+
+    def read(self, n=-1):
+        data = self.f.read(n)
+        self.sha256.update(data)
+        return data
+
+    def drain(self):
+        while self.read(1024 * 1024):
+            pass
+
+# 不需要计算摘要时直接 seek 跳过，否则读过去以便 _HashingReader 计入
+def _skip(reader, n):
+    if hasattr(reader, "seek"):
+        reader.seek(n, os.SEEK_CUR)
+    else:
+        reader.read(n)
+
+def _control_from_tar_gz(fileobj):
+    with tarfile.open(fileobj=fileobj, mode="r|gz") as tar:
+        for member in tar:
+            if os.path.basename(member.name) == "control" and member.isfile():
+                return tar.extractfile(member).read().decode("utf-8", "replace")
+    return None
+
+# 新版 IPK 外层是 tar.gz，旧版（以及 Debian 风格）是 ar 包，两种都包含 control.tar.gz
+def _control_from_ipk(reader, is_ar):
+    if not is_ar:
+        with tarfile.open(fileobj=reader, mode="r|gz") as tar:
+            for member in tar:
+                if os.path.basename(member.name) == "control.tar.gz":
+                    return _control_from_tar_gz(tar.extractfile(member))
+        return None
+    reader.read(8)
+    while True:
+        header = reader.read(60)
+        if len(header) < 60:
+            return None
+        name = header[:16].decode().strip().rstrip("/")
+        size = int(header[48:58])
+        if name == "control.tar.gz":
+            return _control_from_tar_gz(io.BytesIO(reader.read(size)))
+        _skip(reader, size + size % 2)
+
+def guess_control(filename):
+    name_parts = Path(filename).stem.split('_')
+    pkg_name = '_'.join(name_parts[:-2]) if len(name_parts) > 2 else name_parts[0]
+    version = name_parts[-2] if len(name_parts) >= 2 else "1.0"
+    return f"Package: {pkg_name}\nVersion: {version}\nArchitecture: {name_parts[-1]}\n"
+
+# ✅ 单次读取同时解析 control 和计算 SHA256，解析失败时退回按文件名猜测
+# 已知摘要（下载时已计算）时只读取到 control 为止
+def read_ipk(path, sha256=None):
+    path = Path(path)
+    with open(path, "rb") as f:
+        is_ar = f.read(8) == b"!<arch>\n"
+        f.seek(0)
+        reader = f if sha256 else _HashingReader(f)
+        try:
+            control = _control_from_ipk(reader, is_ar)
+        except (tarfile.TarError, EOFError, OSError, ValueError, UnicodeDecodeError):
+            control = None
+        if not sha256:
+            reader.drain()
+            sha256 = reader.sha256.hexdigest()
+    return control or guess_control(path.name), sha256, path.stat().st_size
+
+def read_ipks(paths, digests=None):
+    paths = [str(p) for p in paths]
+    digests = digests or [None] * len(paths)
+    if INDEX_WORKERS <= 1 or len(paths) < 8:
+        return [read_ipk(p, d) for p, d in zip(paths, digests)]
+    with ProcessPoolExecutor(max_workers=INDEX_WORKERS, mp_context=get_context("spawn")) as pool:
+        return list(pool.map(read_ipk, paths, digests, chunksize=16))
 
-    packages_file = opkg_plugin_path / "Packages"
-    gz_file = opkg_plugin_path / "Packages.gz"
+# 与 ipkg-make-index 相同：在 Description 前插入 Filename / Size / SHA256sum
+def format_stanza(control, filename, size, sha256):
+    lines = []
+    inserted = False
+    for line in control.strip("\n").split("\n"):
+        if line.startswith("Description:") and not inserted:
+            lines += [f"Filename: {filename}", f"Size: {size}", f"SHA256sum: {sha256}"]
+            inserted = True
+        lines.append(line)
+    if not inserted:
+        lines += [f"Filename: {filename}", f"Size: {size}", f"SHA256sum: {sha256}"]
+    return "\n".join(lines) + "\n\n"
 
+# ✅ 按 (路径, 大小, mtime, inode) 缓存每个 IPK 的 control 和 SHA256，只重新读取新增或变化的文件
+class IpkMetaCache:
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries = {}
+        self.seen = set()
+        self.hits = 0
+        self.misses = 0
+        self.hashed = 0
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def read(self, paths):
+        results = {}
+        stale = []
+        for path in paths:
+            key = str(path)
+            st = os.stat(path)
+            stamp = [st.st_size, st.st_mtime_ns, st.st_ino]
+            entry = self.entries.get(key)
+            self.seen.add(key)
+            if entry and entry["stamp"] == stamp:
+                self.hits += 1
+                results[key] = (entry["control"], entry["sha256"], st.st_size)
+            else:
+                stale.append((key, stamp))
+        self.misses += len(stale)
+        digests = [BLOB_STORE.digest_of(key) for key, _ in stale]
+        self.hashed += digests.count(None)
+        for (key, stamp), meta in zip(stale, read_ipks([key for key, _ in stale], digests)):
+            self.entries[key] = {"stamp": stamp, "control": meta[0], "sha256": meta[1]}
+            results[key] = meta
+        return [results[str(path)] for path in paths]
+
+    # 只保留本次运行仍然存在的文件
+    def save(self):
+        self.entries = {k: v for k, v in self.entries.items() if k in self.seen}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+
+IPK_META = IpkMetaCache(CACHE_DIR / "ipk-meta.json")
+
+def _file_sha256(path: Path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.digest()
+
+# 内容不变时不写文件；变化时先写临时文件再原子替换
+def write_if_changed(path: Path, data: bytes):
+    if path.exists() and _file_sha256(path) == hashlib.sha256(data).digest():
+        return False
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return True
+
+# 返回 (写入对象, 需要依次关闭的对象)
+def _open_index_output(path: Path, fmt):
+    raw = open(path, "wb")
+    if fmt == "gz":
+        # 固定 mtime、不写文件名，内容不变时输出逐字节一致（相当于 gzip -9n）
+        out = gzip.GzipFile(filename="", mode="wb", compresslevel=9, fileobj=raw, mtime=0)
+        return out, [out, raw]
+    if fmt == "xz":
+        out = lzma.LZMAFile(raw, "wb", preset=9)
+        return out, [out, raw]
+    return raw, [raw]
+
+# ✅ 一次遍历同时写出 Packages 及其压缩版本，全部写入临时文件后再原子替换
+# entries: [(Filename, control, sha256, size), ...]
+def write_packages_index(index_dir: Path, entries):
+    stanzas = [
+        format_stanza(control, filename, size, sha256).encode("utf-8")
+        for filename, control, sha256, size in entries
+    ]
+    sha256 = hashlib.sha256()
+    for stanza in stanzas:
+        sha256.update(stanza)
+
+    # 从 index_formats 中去掉的格式删除旧文件，否则会一直保留过期的索引
+    stale = [index_dir / f"Packages.{fmt}" for fmt in ("gz", "xz") if fmt not in INDEX_FORMATS]
+    stale = [path for path in stale if path.exists()]
+    for path in stale:
+        path.unlink()
+
+    names = ["Packages"] + [f"Packages.{fmt}" for fmt in INDEX_FORMATS]
+    packages_file = index_dir / "Packages"
+    if (packages_file.exists() and _file_sha256(packages_file) == sha256.digest()
+            and all((index_dir / name).exists() for name in names)):
+        return bool(stale)
+
+    outputs = []
+    closers = []
     try:
-        subprocess.run(
-            ["ipkg-make-index", "."],
-            cwd=opkg_plugin_path,
-            check=True,
-            stdout=open(packages_file, "w")
-        )
-        if not packages_file.exists():
-            raise FileNotFoundError("Packages file not created")
-
-        subprocess.run(
-            ["gzip", "-9c", "Packages"],
-            cwd=opkg_plugin_path,
-            stdout=open(gz_file, "wb"),
-            check=True
-        )
+        for name, fmt in zip(names, [None] + INDEX_FORMATS):
+            tmp = index_dir / (name + ".tmp")
+            out, to_close = _open_index_output(tmp, fmt)
+            outputs.append((tmp, index_dir / name, out))
+            closers += to_close
+        for stanza in stanzas:
+            for _, _, out in outputs:
+                out.write(stanza)
+    finally:
+        for f in closers:
+            f.close()
+    for tmp, final, _ in outputs:
+        os.replace(tmp, final)
+    return True
 
-    except Exception as e:
-        log(f"Primary method failed: {str(e)}")
-        with open(packages_file, "w") as f:
-            for ipk in pkg_files:
-                name_parts = ipk.stem.split('_')
-                pkg_name = '_'.join(name_parts[:-2]) if len(name_parts) > 2 else name_parts[0]
-                version = name_parts[-2] if len(name_parts) >= 2 else "1.0"
-                f.write(f"Package: {pkg_name}\n")
-                f.write(f"Version: {version}\n")
-                f.write(f"Architecture: {name_parts[-1]}\n")
-                f.write(f"Filename: ./{ipk.name}\n")
-                f.write(f"Size: {ipk.stat().st_size}\n\n")
-
-        subprocess.run(
-            ["gzip", "-9c", "Packages"],
-            cwd=opkg_plugin_path,
-            stdout=open(gz_file, "wb"),
-            check=True
-        )
-
-    log_ok(f"Index files generated at {opkg_plugin_path}")
-
-def sync_plugin(plugin):
+_VERSION_SUFFIX = re.compile(r"_\d+(?:\.\d+)+$")
+
+# ✅ 架构是 OpenWrt 文件名 name_version_arch.ipk 的最后一段，可能含 "_"（如 mipsel_24kc_24kf），
+# 因此取以 "_" 为界、与已配置平台完全相同的最长后缀；后面只允许再跟一个版本号（如 _23.05）。
+# 平台名出现在包名中间（foo-x86_64_1.0_mipsel_24kc）或只是更长架构名的一部分时都不算匹配
+class PlatformClassifier:
+    def __init__(self, platforms):
+        self.platforms = set(platforms)
+
+    def _suffix(self, stem):
+        parts = stem.split("_")
+        for i in range(1, len(parts)):
+            candidate = "_".join(parts[i:])
+            if candidate == "all" or candidate in self.platforms:
+                return candidate
+        return None
+
+    # 返回资源对应的架构："all"、某个已配置的平台，或 None
+    def classify(self, asset_name):
+        if asset_name.endswith("_all.ipk"):
+            return "all"
+        stem = asset_name[:-len(".ipk")] if asset_name.endswith(".ipk") else asset_name
+        arch = self._suffix(stem)
+        if arch is None:
+            version = _VERSION_SUFFIX.search(stem)
+            if version:
+                arch = self._suffix(stem[:version.start()])
+        return arch
+
+    def platforms_for(self, asset_name, platforms):
+        arch = self.classify(asset_name)
+        if arch == "all":
+            return list(platforms)
+        return [arch] if arch in platforms else []
+
+CLASSIFIER = PlatformClassifier([])
+
+# ✅ 记录每个插件上次发布的 release 和资源摘要，没有变化时跳过复制、清理和索引生成
+class StateManifest:
+    def __init__(self, path: Path):
+        self.path = path
+        self.previous = {}
+        self.current = {}
+        self.checked = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.previous = json.load(f)
+        except (OSError, ValueError):
+            self.previous = {}
+
+    def unchanged(self, name, state):
+        return self.previous.get("plugins", {}).get(name) == state
+
+    def record(self, name, state):
+        with self.lock:
+            self.current[name] = state
+
+    # 上次成功检查 release 的时间，用于调度时优先同步最久未检查的插件
+    def checked_at(self, name):
+        return self.checked.get(name, self.previous.get("checked", {}).get(name, 0))
+
+    def touch(self, name):
+        with self.lock:
+            self.checked[name] = int(time.time())
+
+    # 本次未能获取 release 的插件保留上次的记录
+    def save(self, names, settings):
+        old = self.previous.get("plugins", {})
+        plugins = {name: self.current.get(name, old.get(name)) for name in names if name in self.current or name in old}
+        checked = {name: self.checked_at(name) for name in names if self.checked_at(name)}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        data = {"settings": settings, "plugins": plugins, "checked": checked}
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+        # 守护模式下后续轮询与刚保存的状态比较
+        self.previous = data
+
+STATE = StateManifest(CACHE_DIR / "state.json")
+
+# 大小不符的文件视为上次残留的不完整文件；GitHub 提供了摘要时还要与文件的 SHA256 一致，
+# 同名资源被重新上传（大小相同、内容不同）时重新下载
+def _needs_download(save_path: Path, asset):
+    if not save_path.exists():
+        return True
+    size = asset.get('size')
+    if size is not None and save_path.stat().st_size != size:
+        return True
+    expected = (asset.get('digest') or "").removeprefix("sha256:")
+    if not expected:
+        return False
+    digest = BLOB_STORE.digest_of(save_path)
+    if digest is None:
+        digest = _file_sha256(save_path).hex()
+        BLOB_STORE.remember(save_path, digest)
+    return digest != expected
+
+# 返回 (新文件数, 是否需要更新 opkg)
+def sync_plugin(plugin, dry_run=False):
     log(f"Syncing {plugin['name']}...")
-    releases = get_releases(plugin['repo'])
-    if not releases:
+    # 推迟的插件保留上次的 opkg 输出和状态，下次运行时因最久未检查而优先同步
+    if GITHUB.should_defer(plugin.get("priority", 0)):
+        GITHUB.defer(plugin['name'])
+        log(f"Deferred {plugin['name']}: GitHub API rate limit budget is low ({GITHUB.remaining} left).")
+        return 0, False
+    release_type = plugin.get("release_type", "stable").lower()
+    pages = release_pages(plugin)
+    try:
+        release, scanned = select_release(pages, release_type)
+    except RateLimitError as e:
+        GITHUB.defer(plugin['name'])
+        log(f"Deferred {plugin['name']}: rate limited by GitHub ({e}).")
+        return 0, False
+    except requests.RequestException as e:
+        log(f"Failed to fetch releases for {plugin['name']}: {e}")
+        return 0, False
+    STATE.touch(plugin['name'])
+    if not scanned:
         log(f"No releases found for {plugin['name']}.")
-        return
+        return 0, False
+    if release is None:
+        log(f"No IPK found in {scanned} releases for {plugin['name']}")
+        return 0, False
 
-    release_type = plugin.get("release_type", "stable").lower()
-    if release_type == "stable":
-        filtered_releases = [r for r in releases if not r.get("prerelease", False) and is_stable_version(r['tag_name'])]
-    elif release_type == "pre_release":
-        filtered_releases = [r for r in releases if r.get("prerelease", False)]
-    else:
-        filtered_releases = releases
+    tag = release['tag_name']
+    ipk_assets = [a for a in release['assets'] if a['name'].endswith(".ipk")]
+    jobs = []
+    matched_platforms = set()
+    unclassified = [a['name'] for a in ipk_assets if CLASSIFIER.classify(a['name']) is None]
+    for asset in ipk_assets:
+        asset_name = asset['name']
+        targets = []
 
-    releases_by_time = sorted(filtered_releases, key=lambda r: r['published_at'], reverse=True)
-    releases_by_tag = sorted(filtered_releases, key=lambda r: r['tag_name'], reverse=True)
+        for platform in CLASSIFIER.platforms_for(asset_name, plugin['platforms']):
+            matched_platforms.add(platform)
+            archive_dir = ARCHIVE_DIR / platform / plugin['name'] / tag
+            save_path = archive_dir / asset_name
+            if _needs_download(save_path, asset):
+                targets.append(save_path)
+        if targets:
+            jobs.append((asset, targets))
 
-    new_count = 0
-    found = False
+    state = {
+        "repo": plugin['repo'],
+        "release_type": release_type,
+        "platforms": sorted(plugin['platforms']),
+        "release_id": release.get('id'),
+        "tag": tag,
+        "assets": {a['name']: a.get('digest') or a.get('size') for a in ipk_assets},
+    }
+    published = all((OPKG_DIR / platform / plugin['name'] / tag).exists() for platform in matched_platforms)
+    changed = bool(jobs) or not published or not STATE.unchanged(plugin['name'], state)
+    # 多架构的 release 中通常有很多其他架构的包，只在版本变化时列出一次，便于发现平台名配置错误
+    if unclassified and changed:
+        log(f"{plugin['name']}: {len(unclassified)} IPK assets in {tag} match no configured platform: {', '.join(unclassified)}")
 
-    for release_list in [releases_by_time, releases_by_tag]:
-        for release in release_list:
-            tag = release['tag_name']
-            ipk_assets = [a for a in release.get("assets", []) if a['name'].endswith(".ipk")]
-            if not ipk_assets:
-                continue
+    if dry_run:
+        for asset, targets in jobs:
+            log_plan(f"Download {asset['browser_download_url']} -> {', '.join(str(t) for t in targets)}")
+        if changed:
+            for platform in sorted(matched_platforms):
+                log_plan(f"Update {OPKG_DIR / platform / plugin['name']} to {tag}")
+        else:
+            log_plan(f"{plugin['name']} unchanged at {tag}")
+        return 0, changed
 
-            found = True
-            for asset in ipk_assets:
-                asset_name = asset['name']
-                asset_url = asset['browser_download_url']
-
-                for platform in plugin['platforms']:
-                    if platform in asset_name or asset_name.endswith("_all.ipk"):
-                        archive_dir = ARCHIVE_DIR / platform / plugin['name'] / tag
-                        save_path = archive_dir / asset_name
-                        if not save_path.exists():
-                            if download_asset(asset_url, save_path):
-                                new_count += 1
-            break
-        if found:
-            break
+    if not changed:
+        STATE.record(plugin['name'], state)
+        log_ok(f"{plugin['name']} unchanged at {tag}, skipping.")
+        return 0, False
 
-    if not found:
-        log(f"No IPK found in latest or highest versioned release for {plugin['name']}")
-        return
+    new_count = download_assets(jobs)
 
     for platform in plugin['platforms']:
         platform_archive_path = ARCHIVE_DIR / platform / plugin['name']
@@ -173,16 +1456,151 @@ def sync_plugin(plugin):
         else:
             log(f"Directory not found, skipping copy and index generation: {platform_archive_path}")
 
+    # 有下载失败时不记录状态，下次运行继续重试
+    if new_count == sum(len(targets) for _, targets in jobs):
+        STATE.record(plugin['name'], state)
     log_ok(f"{plugin['name']} sync completed. {new_count} new files.")
+    return new_count, True
+
+def _timed_sync(plugin, dry_run=False):
+    start = time.perf_counter()
+    try:
+        return sync_plugin(plugin, dry_run)
+    finally:
+        METRICS.plugin(plugin['name'], time.perf_counter() - start)
+
+# 同名插件写入同一归档目录，放在同一线程内按顺序同步
+def _sync_group(group, dry_run=False):
+    return [_timed_sync(plugin, dry_run) for plugin in group]
+
+# 返回 [(插件, (新文件数, 是否变化)), ...]
+def _sync_results(plugins, workers=1, dry_run=False):
+    if workers <= 1:
+        results = [(plugin, _timed_sync(plugin, dry_run)) for plugin in plugins]
+    else:
+        groups = {}
+        for plugin in plugins:
+            groups.setdefault(plugin['name'], []).append(plugin)
+        results = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # map 按提交顺序返回结果，日志顺序与串行运行一致
+            for group, (group_results, lines) in zip(groups.values(), pool.map(
+                    lambda group: _buffered(_sync_group, group, dry_run), groups.values())):
+                for line in lines:
+                    _emit(line)
+                results += zip(group, group_results)
+    return results
+
+def sync_plugins(plugins, workers=1, dry_run=False):
+    results = [result for _, result in _sync_results(plugins, workers, dry_run)]
+    new_count = sum(count for count, _ in results)
+    changed = sum(1 for _, plugin_changed in results if plugin_changed)
+    if not dry_run:
+        log_ok(f"Synced {len(plugins)} plugins, {new_count} new files, {changed} changed.")
+    return new_count, changed
+
+class PackageRecord:
+    __slots__ = ("platform", "plugin", "version", "filename", "size", "sha256", "control")
+
+    def __init__(self, platform, plugin, version, filename, size, sha256, control):
+        self.platform = platform
+        self.plugin = plugin
+        self.version = version
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+        self.control = control
+
+    # 相对于平台目录的路径，即 Packages 中的 Filename
+    @property
+    def relpath(self):
+        return f"{self.plugin}/{self.version}/{self.filename}"
+
+# ✅ 一次遍历 opkg 目录构建软件包目录，HTML、Packages、搜索索引和统计都从这里读取
+class FeedCatalog:
+    __slots__ = ("platforms", "packages")
+
+    def __init__(self, platforms, packages):
+        self.platforms = platforms
+        self.packages = packages
+
+    def by_platform(self):
+        groups = {platform: [] for platform in self.platforms}
+        for pkg in self.packages:
+            groups[pkg.platform].append(pkg)
+        return groups
+
+    def total_size(self):
+        return sum(pkg.size for pkg in self.packages)
+
+# found: [(平台, <平台>/<插件>/<版本>/<文件>.ipk 路径), ...]
+def _package_records(found):
+    metas = IPK_META.read([ipk_file for _, ipk_file in found])
+    return [
+        PackageRecord(platform, ipk_file.parent.parent.name, ipk_file.parent.name, ipk_file.name, size, sha256, control)
+        for (platform, ipk_file), (control, sha256, size) in zip(found, metas)
+    ]
+
+def build_catalog(opkg_dir: Path):
+    platforms = []
+    found = []
+    if opkg_dir.exists():
+        for platform_dir in sorted(p for p in opkg_dir.iterdir() if p.is_dir()):
+            platforms.append(platform_dir.name)
+            for ipk_file in sorted(platform_dir.glob("*/*/*.ipk")):
+                if not _superseded(ipk_file):
+                    found.append((platform_dir.name, ipk_file))
+    return FeedCatalog(platforms, _package_records(found))
+
+# 只重新读取受影响的 (平台, 插件) 子树并替换目录中对应的记录，顺序与 build_catalog 一致
+def refresh_catalog(catalog, opkg_dir: Path, affected):
+    found = [
+        (platform, ipk_file)
+        for platform, plugin in sorted(affected)
+        for ipk_file in sorted((opkg_dir / platform / plugin).glob("*/*.ipk"))
+        if not _superseded(ipk_file)
+    ]
+    kept = [pkg for pkg in catalog.packages if (pkg.platform, pkg.plugin) not in affected]
+    catalog.packages = sorted(kept + _package_records(found),
+                              key=lambda pkg: (pkg.platform, pkg.plugin, pkg.version, pkg.filename))
+    catalog.platforms = sorted({p.name for p in opkg_dir.iterdir() if p.is_dir()}) if opkg_dir.exists() else []
+    return catalog
+
+# ✅ 每个平台生成一个搜索分片：软件包列表 + 三元组倒排表（1~2 个字符的查询由浏览器直接扫描文件名）
+def build_search_shard(entries):
+    trigrams = {}
+    for i, entry in enumerate(entries):
+        name = entry[0].lower()
+        for gram in sorted({name[j:j + 3] for j in range(len(name) - 2)}):
+            trigrams.setdefault(gram, []).append(i)
+    return {"packages": entries, "trigrams": trigrams}
 
-def generate_html_index(opkg_dir: Path, output_path: Path):
+# 返回 (分片内容哈希, 是否重写)，哈希用于浏览器缓存失效
+def write_search_shard(path: Path, packages):
+    entries = sorted(([p.filename, p.plugin, p.version, p.size] for p in packages), key=lambda e: e[0].lower())
+    data = json.dumps(build_search_shard(entries), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()[:12], write_if_changed(path, data)
+
+def remove_stale_shards(search_dir: Path, platforms):
+    for stale in search_dir.glob("*.json"):
+        if stale.stem not in platforms:
+            stale.unlink()
+
+# ✅ 页面只包含外壳，软件包列表由浏览器按需加载搜索分片后分页渲染
+# 搜索分片由 build_platforms 生成，shard_versions 为其返回的 {平台: 内容哈希}
+def generate_html_index(output_path: Path, catalog, shard_versions):
     output_path.mkdir(parents=True, exist_ok=True)
     index_file = output_path / "index.html"
+    tmp_file = output_path / "index.html.tmp"
     last_updated = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    platforms = sorted([p.name for p in opkg_dir.glob("*") if p.is_dir()])
-    total_packages = sum(1 for _ in opkg_dir.rglob("*.ipk"))
+    platforms = catalog.platforms
+    platform_tabs = "\n".join(
+        f'            <div class="platform-tab" data-platform="{p}" onclick="showPlatform(\'{p}\')">{p}</div>'
+        for p in platforms
+    )
 
-    html = f"""<!DOCTYPE html>
+    with open(tmp_file, "w", encoding="utf-8", buffering=1024 * 1024) as out:
+        out.write(f"""<!DOCTYPE html>
 <html lang="zh-CN">
 <head>
     <meta charset="UTF-8">
@@ -409,6 +1827,22 @@ def generate_html_index(opkg_dir: Path, output_path: Path):
                 display: none; /* 手机屏幕隐藏版本和大小显示，节省空间 */
             }}
         }}
+        .result-info {{
+            color: var(--gray);
+            font-size: 0.9rem;
+            margin-bottom: 1rem;
+        }}
+
+        #more {{
+            display: none;
+            margin: 1.5rem auto 0;
+            padding: 0.6rem 1.5rem;
+            background: white;
+            border: none;
+            border-radius: 8px;
+            cursor: pointer;
+            box-shadow: var(--card-shadow);
+        }}
     </style>
 </head>
 <body>
@@ -419,156 +1853,424 @@ def generate_html_index(opkg_dir: Path, output_path: Path):
         </header>
 
         <div class="search-box">
-            <input type="text" id="search" placeholder="🔍 输入软件包名称搜索..." onkeyup="searchPackages()">
+            <input type="text" id="search" placeholder="🔍 输入软件包名称搜索..." oninput="searchPackages()">
         </div>
 
         <div class="platform-tabs">
-            <div class="platform-tab active" onclick="showPlatform('all')">全部平台</div>
-            {"".join(f'<div class="platform-tab" onclick="showPlatform(\'{p}\')">{p}</div>' for p in platforms)}
+            <div class="platform-tab active" data-platform="all" onclick="showPlatform('all')">全部平台</div>
+{platform_tabs}
         </div>
 
-        <div id="platform-all" class="platform-content active">
-            <div class="package-grid">
-"""
-
-    # 生成全部平台内容
-    for platform in platforms:
-        platform_dir = opkg_dir / platform
-        for plugin_dir in sorted(platform_dir.glob("*")):
-            if not plugin_dir.is_dir():
-                continue
-            for version_dir in sorted(plugin_dir.glob("*")):
-                if not version_dir.is_dir():
-                    continue
-                for ipk_file in sorted(version_dir.glob("*.ipk")):
-                    file_size = ipk_file.stat().st_size
-                    size_str = f"{file_size/1024:.1f} KB" if file_size < 1024*1024 else f"{file_size/(1024*1024):.1f} MB"
-                    rel_path = f"opkg/{platform}/{plugin_dir.name}/{version_dir.name}/{ipk_file.name}"
-
-                    html += f"""
-                <div class="package-card" data-platform="{platform}" data-name="{ipk_file.name.lower()}">
-                    <div class="package-name">{ipk_file.name}</div>
-                    <div class="package-meta">
-                        <span>版本: {version_dir.name}</span>
-                        <span>大小: {size_str}</span>
-                    </div>
-                    <a href="{rel_path}" class="download-btn">下载</a>
-                </div>
-                    """
-    
-    html += """
-            </div>
+        <div class="platform-content active">
+            <div class="result-info" id="result-info">加载中...</div>
+            <div class="package-grid" id="results"></div>
+            <button id="more" onclick="renderMore()">加载更多</button>
+            <noscript>请启用 JavaScript，或直接浏览 <a href="opkg/">opkg/</a> 目录。</noscript>
         </div>
-    """
-
-    # 生成各平台单独内容
-    for platform in platforms:
-        platform_dir = opkg_dir / platform
-        html += f"""
-        <div id="platform-{platform}" class="platform-content">
-            <div class="package-grid">
-        """
-        
-        for plugin_dir in sorted(platform_dir.glob("*")):
-            if not plugin_dir.is_dir():
-                continue
-            for version_dir in sorted(plugin_dir.glob("*")):
-                if not version_dir.is_dir():
-                    continue
-                for ipk_file in sorted(version_dir.glob("*.ipk")):
-                    file_size = ipk_file.stat().st_size
-                    size_str = f"{file_size/1024:.1f} KB" if file_size < 1024*1024 else f"{file_size/(1024*1024):.1f} MB"
-                    rel_path = f"opkg/{platform}/{plugin_dir.name}/{version_dir.name}/{ipk_file.name}"
-
-                    html += f"""
-                <div class="package-card" data-platform="{platform}" data-name="{ipk_file.name.lower()}">
-                    <div class="package-name">{ipk_file.name}</div>
+
+        <script>
+            // 搜索索引按平台分片，首次用到时才下载
+            const SHARDS = {json.dumps(shard_versions, separators=(",", ":"))};
+            const PAGE_SIZE = {SEARCH_PAGE_SIZE};
+            const PACKAGE_COUNT = {len(catalog.packages)};
+            const loaded = {{}};
+            let searchSeq = 0;
+            let activePlatform = 'all';
+            let results = [];
+            let shown = 0;
+            let timer = null;
+
+            function loadShard(platform) {{
+                if (!loaded[platform]) {{
+                    loaded[platform] = fetch('{SEARCH_DIR}/' + platform + '.json?v=' + SHARDS[platform])
+                        .then(r => r.json());
+                }}
+                return loaded[platform];
+            }}
+
+            // 查询不足 3 个字符时直接扫描文件名做子串匹配，否则取最短的三元组倒排表再做子串校验
+            function searchShard(shard, query) {{
+                if (!query) return shard.packages;
+                if (query.length < 3) return shard.packages.filter(pkg => pkg[0].toLowerCase().includes(query));
+                let best = null;
+                for (let i = 0; i + 3 <= query.length; i++) {{
+                    const list = shard.trigrams[query.slice(i, i + 3)];
+                    if (!list) return [];
+                    if (!best || list.length < best.length) best = list;
+                }}
+                return best.filter(id => shard.packages[id][0].toLowerCase().includes(query)).map(id => shard.packages[id]);
+            }}
+
+            async function runSearch() {{
+                const query = document.getElementById('search').value.trim().toLowerCase();
+                const seq = ++searchSeq;
+                results = [];
+                shown = 0;
+                // 全部平台且没有输入时不下载分片，输入关键字或选择平台后再加载
+                if (activePlatform === 'all' && !query) {{
+                    document.getElementById('results').innerHTML = '';
+                    document.getElementById('more').style.display = 'none';
+                    document.getElementById('result-info').textContent =
+                        '共 ' + PACKAGE_COUNT + ' 个软件包，分布在 ' + Object.keys(SHARDS).length + ' 个平台。输入名称搜索，或选择平台浏览';
+                    return;
+                }}
+                const platforms = activePlatform === 'all' ? Object.keys(SHARDS) : [activePlatform];
+                const shards = await Promise.all(platforms.map(loadShard));
+                // 较早的查询晚返回时丢弃，避免覆盖最新结果
+                if (seq !== searchSeq) return;
+                shards.forEach((shard, i) => {{
+                    for (const pkg of searchShard(shard, query)) results.push([platforms[i], pkg]);
+                }});
+                shown = 0;
+                document.getElementById('results').innerHTML = '';
+                document.getElementById('result-info').textContent = '共 ' + results.length + ' 个结果';
+                renderMore();
+            }}
+
+            function escapeHtml(text) {{
+                return String(text).replace(/[&<>"']/g, c => '&#' + c.charCodeAt(0) + ';');
+            }}
+
+            function formatSize(size) {{
+                return size < 1024 * 1024 ? (size / 1024).toFixed(1) + ' KB' : (size / 1024 / 1024).toFixed(1) + ' MB';
+            }}
+
+            function renderMore() {{
+                const html = results.slice(shown, shown + PAGE_SIZE).map(([platform, [filename, plugin, version, size]]) => `
+                <div class="package-card">
+                    <div class="package-name">${{escapeHtml(filename)}}</div>
                     <div class="package-meta">
-                        <span>版本: {version_dir.name}</span>
-                        <span>大小: {size_str}</span>
+                        <span>版本: ${{escapeHtml(version)}}</span>
+                        <span>大小: ${{formatSize(size)}}</span>
                     </div>
-                    <a href="{rel_path}" class="download-btn">下载</a>
-                </div>
-                    """
-        
-        html += """
-            </div>
-        </div>
-        """
+                    <a href="opkg/${{[platform, plugin, version, filename].map(encodeURIComponent).join('/')}}" class="download-btn">下载</a>
+                </div>`).join('');
+                document.getElementById('results').insertAdjacentHTML('beforeend', html);
+                shown = Math.min(shown + PAGE_SIZE, results.length);
+                document.getElementById('more').style.display = shown < results.length ? 'block' : 'none';
+            }}
 
-    html += f"""
-        <script>
             function showPlatform(platform) {{
                 document.querySelectorAll('.platform-tab').forEach(tab => {{
-                    tab.classList.toggle('active', tab.textContent === platform || 
-                        (platform === 'all' && tab.textContent === '全部平台'));
-                }});
-                document.querySelectorAll('.platform-content').forEach(content => {{
-                    content.classList.toggle('active', 
-                        content.id === 'platform-' + platform || 
-                        (platform === 'all' && content.id === 'platform-all'));
+                    tab.classList.toggle('active', tab.dataset.platform === platform);
                 }});
+                activePlatform = platform;
+                runSearch();
             }}
-            
+
             function searchPackages() {{
-                const input = document.getElementById('search');
-                const filter = input.value.toLowerCase();
-                const items = document.querySelectorAll('.package-card');
-                
-                items.forEach(item => {{
-                    const name = item.getAttribute('data-name');
-                    const platform = item.getAttribute('data-platform');
-                    const isMatch = name.includes(filter);
-                    const isActivePlatform = 
-                        document.querySelector('.platform-tab.active').textContent === '全部平台' ||
-                        platform === document.querySelector('.platform-tab.active').textContent;
-                    
-                    item.style.display = (isMatch && isActivePlatform) ? 'flex' : 'none';
-                }});
+                clearTimeout(timer);
+                timer = setTimeout(runSearch, 150);
             }}
-            
-            document.addEventListener('DOMContentLoaded', function() {{
-                showPlatform('all');
-            }});
+
+            document.addEventListener('DOMContentLoaded', runSearch);
         </script>
         
         <footer>
-            <p>自动生成于 {last_updated} | 共 {total_packages} 个软件包</p>
+            <p>自动生成于 {last_updated} | 共 {len(catalog.packages)} 个软件包</p>
             <p>Powered by OpenWrt IPK Center</p>
         </footer>
     </div>
 </body>
 </html>
-    """
+""")
 
-    with open(index_file, "w", encoding="utf-8") as f:
-        f.write(html)
+    os.replace(tmp_file, index_file)
     log_ok(f"Generated HTML index: {index_file}")
 
 # ✅ 生成平台级 Packages.gz（用于 opkg 源）
-def generate_platform_level_packages_index(opkg_dir: Path):
-    for platform_dir in opkg_dir.glob("*"):
-        if not platform_dir.is_dir():
-            continue
-        all_ipks = list(platform_dir.glob("**/*.ipk"))
-        if not all_ipks:
-            continue
-        packages_file = platform_dir / "Packages"
-        gz_file = platform_dir / "Packages.gz"
-        with open(packages_file, "w") as f:
-            for ipk in all_ipks:
-                name_parts = ipk.stem.split('_')
-                pkg_name = '_'.join(name_parts[:-2]) if len(name_parts) > 2 else name_parts[0]
-                version = name_parts[-2] if len(name_parts) >= 2 else "1.0"
-                f.write(f"Package: {pkg_name}\n")
-                f.write(f"Version: {version}\n")
-                f.write(f"Architecture: {name_parts[-1]}\n")
-                f.write(f"Filename: {ipk.relative_to(platform_dir)}\n")
-                f.write(f"Size: {ipk.stat().st_size}\n\n")
-        subprocess.run(["gzip", "-9c", "Packages"], cwd=platform_dir, stdout=open(gz_file, "wb"), check=True)
+def _write_platform_index(platform_dir, packages):
+    entries = [(pkg.relpath, pkg.control, pkg.sha256, pkg.size) for pkg in packages]
+    changed = write_packages_index(platform_dir, entries)
+    if changed:
         log_ok(f"Generated platform-level Packages.gz in {platform_dir}")
+    else:
+        log(f"Platform-level Packages.gz unchanged in {platform_dir}")
+    return changed
+
+# ✅ 每个平台一个构建单元：生成该平台的 Packages 索引（及压缩版本）和搜索分片
+# 在子进程中运行，参数和返回值都是可序列化的基本类型；返回 (分片哈希, 分片是否重写, 索引是否重写, 日志)
+def build_platform_unit(platform_dir, search_file, records, index_formats):
+    global INDEX_FORMATS
+    INDEX_FORMATS = index_formats
+    packages = [PackageRecord(*record) for record in records]
+    changed, lines = False, []
+    if packages:
+        changed, lines = _buffered(_write_platform_index, Path(platform_dir), packages)
+    return (*write_search_shard(Path(search_file), packages), changed, lines)
+
+# 各平台构建单元分发到进程池，结果按平台顺序合并；软件包较少时在当前进程内依次构建
+# 指定 platforms 时只构建这些平台（守护模式的增量重建），返回值只包含它们的分片哈希
+def build_platforms(catalog, opkg_dir: Path, search_dir: Path, platforms=None):
+    search_dir.mkdir(parents=True, exist_ok=True)
+    slots = PackageRecord.__slots__
+    groups = {p: pkgs for p, pkgs in catalog.by_platform().items() if platforms is None or p in platforms}
+    units = [
+        (str(opkg_dir / platform), str(search_dir / f"{platform}.json"),
+         [tuple(getattr(pkg, slot) for slot in slots) for pkg in packages], INDEX_FORMATS)
+        for platform, packages in groups.items()
+    ]
+    workers = max(1, min(len(units), INDEX_WORKERS))
+    if workers <= 1 or len(catalog.packages) < PARALLEL_BUILD_MIN:
+        workers = 1
+        results = [build_platform_unit(*unit) for unit in units]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+            results = list(pool.map(build_platform_unit, *zip(*units)))
+    versions = {}
+    rewritten = 0
+    for platform, (shard_version, shard_written, changed, lines) in zip(groups, results):
+        for line in lines:
+            _emit(line)
+        versions[platform] = shard_version
+        rewritten += changed
+        METRICS.add("shards_rewritten" if shard_written else "shards_unchanged")
+        METRICS.add("indexes_rewritten" if changed else "indexes_unchanged")
+    if platforms is None:
+        remove_stale_shards(search_dir, versions)
+    log(f"Built {len(units)} platforms with {workers} processes: "
+        f"{rewritten} Packages indexes rewritten, {len(units) - rewritten} unchanged")
+    return versions
+
+_CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".json": "application/json",
+    ".gz": "application/gzip",
+    ".xz": "application/x-xz",
+    ".ipk": "application/octet-stream",
+}
+
+def _read_generation():
+    try:
+        return GENERATION_FILE.read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+
+# ✅ 一次构建的只读视图：索引文件内容和 ETag 常驻内存，IPK 的 ETag 取自 blob manifest 或 IPK 元数据缓存
+# 请求开始时取一次快照引用，整个请求都使用同一代构建
+class FeedSnapshot:
+    def __init__(self, root: Path):
+        self.root = root
+        self.generation = _read_generation()
+        self.files = {}
+        self.blobs = BlobStore(BLOB_DIR, CACHE_DIR / "blob-manifest.json")
+        self.blobs.load()
+        self.meta = IpkMetaCache(CACHE_DIR / "ipk-meta.json")
+        self.meta.load()
+        self.etags = {}
+        self.lock = threading.Lock()
+        candidates = [root / "index.html", *(root / SEARCH_DIR).glob("*.json"), *(root / OPKG_DIR.name).glob("*/Packages*")]
+        # 构建过程中的临时文件随时会被改名，先排除再 stat
+        for path in candidates:
+            if path.name.endswith(".tmp") or not path.is_file() or path.stat().st_size > SERVE_CACHE_MAX:
+                continue
+            data = path.read_bytes()
+            self.files[path.relative_to(root).as_posix()] = (data, f'"{hashlib.sha256(data).hexdigest()}"')
+
+    # 只有两处都查不到（如手工放入的文件）时才读取文件计算摘要，结果按 inode/大小/mtime 缓存
+    def etag_for(self, path: Path, st):
+        key = (st.st_ino, st.st_size, st.st_mtime_ns)
+        with self.lock:
+            if key in self.etags:
+                return self.etags[key]
+        digest = self.blobs.digest_of(path)
+        if not digest:
+            entry = self.meta.entries.get(str(path.relative_to(self.root)))
+            if entry and entry["stamp"] == [st.st_size, st.st_mtime_ns, st.st_ino]:
+                digest = entry["sha256"]
+        if not digest:
+            digest = _file_sha256(path).hex()
+        with self.lock:
+            self.etags[key] = f'"{digest}"'
+        return self.etags[key]
+
+# 返回 (起始, 结束)；无法满足时返回 False；没有或不支持的 Range（如多段）返回 None，按完整内容响应
+def _parse_range(header, size):
+    m = re.fullmatch(r"bytes=(\d*)-(\d*)", (header or "").strip())
+    if not m or not (m[1] or m[2]):
+        return None
+    if m[1]:
+        start = int(m[1])
+        end = min(int(m[2]), size - 1) if m[2] else size - 1
+    else:
+        start, end = max(0, size - int(m[2])), size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+class FeedRequestHandler(BaseHTTPRequestHandler):
+    server_version = "IPKCenter"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._serve(head=False)
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def _resolve(self):
+        path = posixpath.normpath(unquote(urlparse(self.path).path)).lstrip("/")
+        if path in ("", "."):
+            path = "index.html"
+        if path.startswith("..") or path.split("/", 1)[0] not in SERVE_ROOTS:
+            return None
+        return path
+
+    def _reply(self, status, headers, length=0):
+        self.send_response(status)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+
+    def _serve(self, head):
+        snapshot = self.server.snapshot
+        rel = self._resolve()
+        cached = snapshot.files.get(rel) if rel else None
+        if cached:
+            data, etag = cached
+            size = len(data)
+        else:
+            path = snapshot.root / rel if rel else None
+            try:
+                st = path.stat() if path else None
+            except OSError:
+                st = None
+            if st is None or not path.is_file():
+                return self._reply(404, [])
+            data, size, etag = None, st.st_size, snapshot.etag_for(path, st)
+
+        # 同一版本目录中的 IPK 可能被重新上传替换，所有文件都按 ETag 重新验证
+        headers = [
+            ("ETag", etag),
+            ("Accept-Ranges", "bytes"),
+            ("Cache-Control", "no-cache"),
+        ]
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match and (if_none_match.strip() == "*" or etag in (t.strip().removeprefix("W/") for t in if_none_match.split(","))):
+            return self._reply(304, headers)
+
+        content_type = _CONTENT_TYPES.get(posixpath.splitext(rel)[1], "text/plain; charset=utf-8")
+        headers.append(("Content-Type", content_type))
+        byte_range = None
+        if self.headers.get("If-Range", etag) == etag:
+            byte_range = _parse_range(self.headers.get("Range"), size)
+        if byte_range is False:
+            return self._reply(416, headers + [("Content-Range", f"bytes */{size}")])
+        start, end = byte_range or (0, size - 1)
+        status = 206 if byte_range else 200
+        if byte_range:
+            headers.append(("Content-Range", f"bytes {start}-{end}/{size}"))
+        length = max(0, end - start + 1)
+        self._reply(status, headers, length)
+        if head or not length:
+            return
+        try:
+            if data is not None:
+                self.wfile.write(data[start:end + 1])
+            else:
+                # 零拷贝发送：socket.sendfile 在支持的平台上使用 os.sendfile
+                with open(path, "rb") as f:
+                    self.connection.sendfile(f, start, length)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+class FeedServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, root: Path):
+        self.root = root
+        self.snapshot = FeedSnapshot(root)
+        super().__init__(address, FeedRequestHandler)
+
+    # 生成标记变化时在后台构建新快照，再整体替换引用；进行中的请求继续使用旧快照
+    def watch(self, interval=1.0):
+        while True:
+            time.sleep(interval)
+            generation = _read_generation()
+            if generation == self.snapshot.generation:
+                continue
+            # 构建快照失败时继续使用旧快照，下一轮重试，监视线程不能退出
+            try:
+                snapshot = FeedSnapshot(self.root)
+            except Exception as e:
+                log(f"Failed to load build {generation}, still serving {self.snapshot.generation}: {e}")
+                continue
+            self.snapshot = snapshot
+            log(f"Serving build {generation} ({len(snapshot.files)} index files cached)")
+
+def serve(bind, port):
+    server = FeedServer((bind, port), DOCS_DIR)
+    threading.Thread(target=server.watch, daemon=True).start()
+    log(f"Serving {DOCS_DIR.resolve()} on http://{bind}:{server.server_port}/ "
+        f"({len(server.snapshot.files)} index files cached)")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="OpenWrt IPK Center sync")
+    parser.add_argument("command", nargs="?", choices=["sync", "serve"], default="sync",
+                        help="sync (default) updates the feed; serve publishes the generated tree over HTTP")
+    parser.add_argument("--bind", default="0.0.0.0", help="address for serve to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="port for serve to listen on")
+    parser.add_argument("--workers", type=int, help="number of plugins synced concurrently")
+    parser.add_argument("--per-host", type=int, help="max concurrent requests per host")
+    parser.add_argument("--backend", choices=["rest", "graphql"],
+                        help="how release lists are fetched: one REST call per repo, or batched GraphQL queries")
+    parser.add_argument("--plan", "--dry-run", action="store_true",
+                        help="print the downloads and rebuilds a run would do, without changing anything")
+    parser.add_argument("--metrics-dir", type=Path, default=CACHE_DIR,
+                        help="where run-report.json and the ipk_center.prom textfile are written")
+    parser.add_argument("--profile", metavar="FILE", help="run under cProfile and write the stats to FILE")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running, poll each repo on its own interval and rebuild only what changed")
+    args = parser.parse_args(argv)
+    if args.daemon and args.plan:
+        parser.error("--daemon cannot be combined with --plan")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "serve":
+        try:
+            serve(args.bind, args.port)
+        except KeyboardInterrupt:
+            log("Server stopped.")
+        return
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        if args.daemon:
+            daemon(args)
+        else:
+            with METRICS.phase("total"):
+                run(args)
+    except KeyboardInterrupt:
+        if not args.daemon:
+            raise
+        log("Daemon stopped.")
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            log(f"Profile written to {args.profile}")
+        # 守护模式在每次轮询结束时已经写过报告
+        if not args.plan and not args.daemon:
+            METRICS.write(args.metrics_dir)
+
+# 读取配置并应用 settings，返回 (plugins, settings, workers)；没有插件时返回 None
+def load_config(args):
+    global PER_HOST_LIMIT, RELEASES_PER_PAGE, DOWNLOAD_WORKERS, INDEX_FORMATS, RELEASE_BACKEND, HEDGE_AFTER, CLASSIFIER
+    global POLL_MIN, POLL_MAX
 
-def main():
     if not os.path.isfile(CONFIG_FILE):
         log(f"Config file {CONFIG_FILE} not found!")
         sys.exit(1)
@@ -579,17 +2281,257 @@ def main():
     plugins = config.get("plugins", [])
     if not plugins:
         log("No plugins configured.")
-        return
+        return None
 
-    for plugin in plugins:
-        sync_plugin(plugin)
+    CLASSIFIER = PlatformClassifier(platform for plugin in plugins for platform in plugin['platforms'])
+    settings = config.get("settings", {})
+    workers = args.workers or settings.get("workers", SYNC_WORKERS)
+    PER_HOST_LIMIT = args.per_host or settings.get("per_host_limit", PER_HOST_LIMIT)
+    RELEASES_PER_PAGE = settings.get("releases_per_page", RELEASES_PER_PAGE)
+    DOWNLOAD_WORKERS = settings.get("download_workers", DOWNLOAD_WORKERS)
+    DOWNLOAD_LIMITER.rate = settings.get("download_rate_limit", DOWNLOAD_RATE_LIMIT)
+    INDEX_FORMATS = settings.get("index_formats", INDEX_FORMATS)
+    RELEASE_BACKEND = args.backend or settings.get("release_backend", RELEASE_BACKEND)
+    HEDGE_AFTER = settings.get("hedge_after", HEDGE_AFTER)
+    POLL_MIN = settings.get("poll_min", POLL_MIN)
+    POLL_MAX = settings.get("poll_max", POLL_MAX)
+    return plugins, settings, workers
+
+def sync_all(plugins, workers, dry_run=False):
+    scheduled = GITHUB.schedule(plugins, STATE.checked_at)
+    with METRICS.phase("sync"):
+        if RELEASE_BACKEND == "graphql":
+            prefetch_releases(scheduled)
+        _, changed = sync_plugins(scheduled, workers=workers, dry_run=dry_run)
+    # --plan 不写任何文件，ETag 缓存也留到真正同步时再更新
+    if not dry_run:
+        RELEASE_CACHE.save()
+        BLOB_STORE.save()
+    log(f"Release cache: {RELEASE_CACHE.hits} hits, {RELEASE_CACHE.misses} misses")
+    log(GITHUB.summary())
+    return changed
+
+def prune_blobs():
+    with METRICS.phase("prune"):
+        pruned = BLOB_STORE.prune()
+        if pruned:
+            BLOB_STORE.save()
+    blob_count, blob_bytes = BLOB_STORE.stats()
+    log(f"Blob store: {blob_count} blobs ({blob_bytes} bytes), {pruned} pruned, "
+        f"{BLOB_STORE.bytes_saved} bytes saved by deduplication")
+
+# 完整重建所有平台的索引、搜索分片和 index.html，返回 (catalog, 分片哈希) 供守护模式增量更新
+def rebuild_outputs(names, settings):
+    prune_blobs()
+    IPK_META.load()
+    with METRICS.phase("catalog"):
+        catalog = build_catalog(OPKG_DIR)
+    log(f"Catalog: {len(catalog.packages)} packages on {len(catalog.platforms)} platforms, "
+        f"{catalog.total_size()} bytes")
+
+    # ✅ 平台级 Packages.gz 和搜索分片按平台并行构建，再合并生成 index.html
+    with METRICS.phase("build_platforms"):
+        shard_versions = build_platforms(catalog, OPKG_DIR, DOCS_DIR / SEARCH_DIR)
+    with METRICS.phase("html"):
+        generate_html_index(DOCS_DIR, catalog, shard_versions)
+    touch_nojekyll()
+    IPK_META.save()
+    log(f"IPK metadata cache: {IPK_META.hits} hits, {IPK_META.misses} misses, {IPK_META.hashed} files hashed")
+    publish(names, settings)
+    return catalog, shard_versions
 
-    generate_html_index(OPKG_DIR, Path("."))
+# .nojekyll 不在 workflow 的缓存中，跳过重建时也要重新创建，供发布步骤复制
+def touch_nojekyll():
     Path(".nojekyll").touch()
     log_ok("Created .nojekyll")
 
-    # ✅ 添加平台级 Packages.gz 生成
-    generate_platform_level_packages_index(OPKG_DIR)
+# 所有输出都已写完后才更新标记，serve 不会切换到写了一半的构建
+def mark_generation():
+    GENERATION_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = GENERATION_FILE.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(str(time.time_ns()))
+    os.replace(tmp, GENERATION_FILE)
+
+# ✅ 先发布新构建，再删除被取代的版本；state 最后保存，
+# 中途退出时下次运行会重新同步这些插件并再次清理
+def publish(names, settings):
+    mark_generation()
+    remove_superseded()
+    STATE.save(names, settings)
+
+def run(args):
+    loaded = load_config(args)
+    if not loaded:
+        return
+    plugins, settings, workers = loaded
+
+    RELEASE_CACHE.load()
+    BLOB_STORE.load()
+    STATE.load()
+    changed = sync_all(plugins, workers, dry_run=args.plan)
+
+    names = [plugin['name'] for plugin in plugins]
+    removed = set(STATE.previous.get("plugins", {})) - set(names)
+    outputs_ready = (DOCS_DIR / "index.html").exists() and OPKG_DIR.exists()
+    needs_rebuild = changed or removed or not outputs_ready or STATE.previous.get("settings") != settings
+    if args.plan:
+        log_plan("Rebuild index.html, search index and Packages indexes" if needs_rebuild else "Nothing to do")
+        return
+    if not needs_rebuild:
+        log_ok("No upstream changes, skipping clean, copy and index stages.")
+        touch_nojekyll()
+        # 仍然保存检查时间，否则调度顺序不会变化，额度不足时总是推迟同一批插件
+        STATE.save(names, settings)
+        return
+    rebuild_outputs(names, settings)
+
+def _timestamp(published_at):
+    try:
+        return datetime.datetime.fromisoformat(published_at.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+# 仓库最近一页 release 的发布时间（升序），取自 ETag 缓存或 GraphQL 预取结果，不额外请求
+def release_history(plugin):
+    repo = plugin['repo']
+    if repo in PREFETCHED_RELEASES:
+        releases = PREFETCHED_RELEASES[repo][0]
+    else:
+        entry = RELEASE_CACHE.get(_releases_url(repo, plugin.get("per_page")))
+        releases = entry["body"]["releases"] if entry else []
+    return sorted(t for t in (_timestamp(r.get("published_at") or "") for r in releases) if t)
+
+# ✅ 按仓库自适应轮询：间隔取该仓库 release 间隔中位数的 1/POLL_DIVISOR，
+# 连续未变化时逐步放慢（每次 ×1.5，不超过 POLL_MAX），有新版本后恢复
+class RepoPoller:
+    def __init__(self):
+        self.interval = {}
+        self.next_poll = {}
+
+    @staticmethod
+    def base_interval(published):
+        gaps = sorted(b - a for a, b in zip(published, published[1:]) if b > a)
+        if not gaps:
+            return POLL_MAX
+        return min(POLL_MAX, max(POLL_MIN, gaps[len(gaps) // 2] / POLL_DIVISOR))
+
+    def update(self, plugin, changed, now):
+        repo = plugin['repo']
+        base = self.base_interval(release_history(plugin))
+        if changed or repo not in self.interval:
+            interval = base
+        else:
+            interval = min(POLL_MAX, max(base, self.interval[repo] * 1.5))
+        self.interval[repo] = interval
+        # 加一点随机抖动，避免同时启动的仓库每次都挤在同一时刻轮询
+        self.next_poll[repo] = now + interval * random.uniform(0.9, 1.1)
+
+    # 轮询出错时按最短间隔重试，不计入“无变化”的退避
+    def retry(self, plugin, now):
+        self.next_poll[plugin['repo']] = now + POLL_MIN * random.uniform(0.9, 1.1)
+
+    def due(self, plugins, now):
+        return [plugin for plugin in plugins if self.next_poll.get(plugin['repo'], 0) <= now]
+
+    def next_due(self):
+        return min(self.next_poll.values(), default=time.time())
+
+# 守护模式的增量重建：只重新读取受影响的 opkg/<平台>/<插件> 子树，重建这些平台的索引、分片和 index.html
+def rebuild_affected(catalog, shard_versions, affected, names, settings):
+    with METRICS.phase("catalog"):
+        refresh_catalog(catalog, OPKG_DIR, affected)
+    platforms = {platform for platform, _ in affected}
+    with METRICS.phase("build_platforms"):
+        shard_versions.update(build_platforms(catalog, OPKG_DIR, DOCS_DIR / SEARCH_DIR, platforms))
+    with METRICS.phase("html"):
+        generate_html_index(DOCS_DIR, catalog, shard_versions)
+    prune_blobs()
+    IPK_META.save()
+    publish(names, settings)
+
+# 守护模式的每次完整同步或轮询单独统计指标
+def new_metrics():
+    global METRICS
+    METRICS = RunMetrics(RunMetrics.external_counters())
+    return METRICS
+
+# ✅ 常驻运行：保持连接池、缓存和软件包目录在内存中，按仓库各自的间隔轮询，只重建有变化的部分
+# config.json 修改后重新读取配置并完整同步一次
+# 读取 config.json 的修改时间失败时（如编辑器正在替换文件）沿用当前配置
+def _config_unchanged(stamp):
+    try:
+        return os.stat(CONFIG_FILE).st_mtime_ns == stamp
+    except Exception as e:
+        log(f"Cannot stat {CONFIG_FILE}: {e}; keeping the current config.")
+        return True
+
+def daemon(args):
+    while True:
+        loaded = load_config(args)
+        if not loaded:
+            return
+        plugins, settings, workers = loaded
+        names = [plugin['name'] for plugin in plugins]
+
+        # ✅ 首次完整同步失败时稍后重新加载配置再试，守护进程不退出
+        try:
+            config_stamp = os.stat(CONFIG_FILE).st_mtime_ns
+            with new_metrics().phase("total"):
+                RELEASE_CACHE.load()
+                BLOB_STORE.load()
+                STATE.load()
+                sync_all(plugins, workers)
+                catalog, shard_versions = rebuild_outputs(names, settings)
+            METRICS.write(args.metrics_dir)
+        except Exception as e:
+            log(f"Full sync failed: {e!r}; retrying in {CONFIG_CHECK_INTERVAL}s.")
+            time.sleep(CONFIG_CHECK_INTERVAL)
+            continue
+
+        poller = RepoPoller()
+        now = time.time()
+        for plugin in plugins:
+            poller.update(plugin, True, now)
+
+        # 已同步但尚未成功重建的 (平台, 插件)，下一轮轮询时一并重建
+        pending = set()
+        while _config_unchanged(config_stamp):
+            # ✅ 单轮轮询出错只记录日志并重新排期，不中断守护进程
+            try:
+                # 额度耗尽时等到重置时间再继续
+                if GITHUB.exhausted():
+                    wait_for = GITHUB.reset - time.time() + 1
+                    log(f"GitHub API rate limit exhausted, sleeping {wait_for:.0f}s until it resets.")
+                    time.sleep(wait_for)
+                now = time.time()
+                due = poller.due(plugins, now)
+                if due:
+                    log(f"Polling {len(due)} of {len(plugins)} repos...")
+                    with new_metrics().phase("total"):
+                        with METRICS.phase("sync"):
+                            if RELEASE_BACKEND == "graphql":
+                                prefetch_releases(due)
+                            results = _sync_results(due, workers)
+                        RELEASE_CACHE.save()
+                        BLOB_STORE.save()
+                        for plugin, (_, changed) in results:
+                            poller.update(plugin, changed, now)
+                            if changed:
+                                pending |= {(platform, plugin['name']) for platform in plugin['platforms']}
+                        if pending:
+                            rebuild_affected(catalog, shard_versions, pending, names, settings)
+                            log_ok(f"Rebuilt {len(pending)} plugin trees on {len({p for p, _ in pending})} platforms.")
+                            pending = set()
+                        else:
+                            STATE.save(names, settings)
+                    METRICS.write(args.metrics_dir)
+            except Exception as e:
+                log(f"Poll failed: {e!r}; retrying in {POLL_MIN}s.")
+                for plugin in poller.due(plugins, now):
+                    poller.retry(plugin, now)
+            time.sleep(max(1.0, min(poller.next_due() - time.time(), CONFIG_CHECK_INTERVAL)))
+        log(f"{CONFIG_FILE} changed, reloading.")
 
 if __name__ == "__main__":
     main()